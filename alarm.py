@@ -1,28 +1,46 @@
+from __future__ import annotations
+
 import time
+startup_time = time.perf_counter()  # before the imports below, the startup phases include them
 import json
+import asyncio
 import threading
 import logging
 import logging.handlers
 import datetime
-import paho.mqtt.client as mqtt
+import importlib
 import RPi.GPIO as GPIO
 import configparser
 import argparse
 import atexit
 import os
+import sys
 import math
+import signal
 import random
-import statistics
 from itertools import chain
-from dataclasses import dataclass, field
+from dataclasses import asdict, dataclass, field
 from enum import Enum, auto
-from typing import Optional
+from functools import partial
+from typing import TYPE_CHECKING, Callable, Optional
 
 from pushover import Pushover
 import hass_discovery as hass
 from healthchecks import HealthChecks
 from arduino import Arduino
 from battery import Battery
+from battery_analytics import BatteryAnalytics
+from digest import Category, Digest
+from filters import MovingMedian, create_filter
+from gpio_inputs import GpioLevels, InputEngine
+from zone_registry import ZoneRegistry
+from runtime import Runtime
+from settings import Settings
+from spool import Spool
+from state_store import StateLog
+
+if TYPE_CHECKING:
+    import paho.mqtt.client as mqtt  # imported in the background by mqtt_connect
 
 GPIO.setmode(GPIO.BCM)   # set board mode to Broadcom
 GPIO.setwarnings(False)  # don't show warnings
@@ -48,6 +66,12 @@ parser.add_argument('--log', dest='log_level', action='store', choices=["DEBUG",
 # parser.set_defaults(feature=True)
 args = parser.parse_args()
 
+runtime = Runtime()
+
+
+def startup_phase(phase: str) -> None:
+    logging.info("Startup: %s after %.3f s", phase, time.perf_counter() - startup_time)
+
 
 class ArmMode(Enum):
     Home = auto()
@@ -101,7 +125,36 @@ class ZoneAttribute(Enum):
         return self.name
 
 
+@dataclass(frozen=True, slots=True)
+class ZoneRoute:
+    home: bool
+    away: bool
+    away_instant: bool
+    away_delayed: bool
+    water: bool
+    direct: bool
+    fire: bool
+    notify: bool
+    tamper: bool
+
+    @classmethod
+    def resolve(cls, dev_class: DevClass, arm_modes: list[ArmMode]) -> "ZoneRoute":
+        return cls(
+            home=ArmMode.Home in arm_modes,
+            away=ArmMode.Away in arm_modes or ArmMode.AwayDelayed in arm_modes,
+            away_instant=ArmMode.Away in arm_modes,
+            away_delayed=ArmMode.AwayDelayed in arm_modes,
+            water=ArmMode.Water in arm_modes,
+            direct=ArmMode.Direct in arm_modes,
+            fire=ArmMode.Fire in arm_modes,
+            notify=ArmMode.Notify in arm_modes,
+            tamper=dev_class == DevClass.Tamper
+        )
+
+
 class Zone:
+    __slots__ = ("key", "label", "dev_class", "arm_modes", "attributes", "route", "index", "mask")
+
     def __init__(self, key: str, label: str, dev_class: DevClass,
                  arm_modes: list[ArmMode], attributes: list[ZoneAttribute] = None):
         self.key = key
@@ -109,13 +162,19 @@ class Zone:
         self.dev_class = dev_class
         self.arm_modes = arm_modes
         self.attributes = attributes if attributes is not None else []
+        self.route = ZoneRoute.resolve(dev_class, arm_modes)
+        self.index = -1  # assigned by the zone registry
+        self.mask = 0
 
 
 class Input(Zone):
+    __slots__ = ("gpio", "debounce")
+
     def __init__(self, key: str, gpio: int, label: str, dev_class: DevClass,
-                 arm_modes: list[ArmMode], attributes: list[ZoneAttribute] = None):
+                 arm_modes: list[ArmMode], attributes: list[ZoneAttribute] = None, debounce: float = 0.05):
         super().__init__(key, label, dev_class, arm_modes, attributes)
         self.gpio = gpio
+        self.debounce = debounce
 
     def __str__(self):
         return self.label
@@ -123,7 +182,9 @@ class Input(Zone):
     def __repr__(self):
         return f"i{self.gpio}:{self.label} {self.attributes}"
 
-    def get(self):
+    def get(self, levels: Optional[int] = None):
+        if levels is not None:
+            return bool(levels >> self.gpio & 1)
         return GPIO.input(self.gpio) == 1
 
     @property
@@ -150,7 +211,9 @@ class Output:
             if self.debug:
                 logging.debug("Output: %s set to %s", self, value)
 
-    def get(self):
+    def get(self, levels: Optional[int] = None):
+        if levels is not None:
+            return bool(levels >> self.gpio & 1)
         return GPIO.input(self.gpio) == 1
 
     @property
@@ -159,6 +222,8 @@ class Output:
 
 
 class Sensor(Zone):
+    __slots__ = ("topic", "field", "value", "timeout", "timestamp", "linkquality")
+
     def __init__(self, key: str, topic: str, field: str, value: SensorValue, label: str, dev_class: DevClass,
                  arm_modes: list[ArmMode], timeout: int = 0, attributes: list[ZoneAttribute] = None):
         super().__init__(key, label, dev_class, arm_modes, attributes)
@@ -167,7 +232,7 @@ class Sensor(Zone):
         self.value = value
         self.timeout = timeout
         self.timestamp = time.time()
-        self.linkquality = []
+        self.linkquality: MovingMedian = MovingMedian(10)
 
     def __str__(self):
         return self.label
@@ -175,8 +240,8 @@ class Sensor(Zone):
     def __repr__(self):
         return f"s:{self.label} {self.attributes}"
 
-    def get(self):
-        return state.data["zones"][self.key]
+    def get(self, levels: Optional[int] = None):
+        return zone_registry.get(self)
 
     @property
     def is_true(self):
@@ -226,7 +291,7 @@ class AlarmPanel:
         self.set_states = set_states or {}
         self.timeout = timeout
         self.timestamp = time.time()
-        self.linkquality = []
+        self.linkquality: MovingMedian = MovingMedian(10)
 
     def __str__(self):
         return self.label
@@ -240,7 +305,7 @@ class AlarmPanel:
 
         logging.debug("Sending state: %s to alarm panel %s", self.set_states[alarm_state], self.label)
         data = {"arm_mode": {"mode": self.set_states[alarm_state]}}
-        mqtt_client.publish(f"{self.topic}/set", json.dumps(data), retain=False)
+        mqtt_publish(f"{self.topic}/set", json.dumps(data))
 
     def validate(self, transaction: str, alarm_action: AlarmPanelAction):
         if transaction is None or alarm_action not in self.actions:
@@ -248,7 +313,7 @@ class AlarmPanel:
 
         logging.debug("Sending verification: %s to alarm panel %s", self.actions[alarm_action], self.label)
         data = {"arm_mode": {"transaction": int(transaction), "mode": self.actions[alarm_action]}}
-        mqtt_client.publish(f"{self.topic}/set", json.dumps(data), retain=False)
+        mqtt_publish(f"{self.topic}/set", json.dumps(data))
 
 
 inputs = {
@@ -507,12 +572,19 @@ sensors = {
 zones = inputs | sensors
 # zones = Zones(inputs, sensors)
 
+tamper_zones = [v for k, v in zones.items() if v.dev_class == DevClass.Tamper]
 home_zones = [v for k, v in zones.items() if ArmMode.Home in v.arm_modes]
 away_zones = [v for k, v in zones.items() if ArmMode.Away in v.arm_modes or ArmMode.AwayDelayed in v.arm_modes]
 water_zones = [v for k, v in zones.items() if ArmMode.Water in v.arm_modes]
 direct_zones = [v for k, v in zones.items() if ArmMode.Direct in v.arm_modes]
 fire_zones = [v for k, v in zones.items() if ArmMode.Fire in v.arm_modes]
 notify_zones = [v for k, v in zones.items() if ArmMode.Notify in v.arm_modes]
+open_warning_zones = [v for k, v in zones.items() if ZoneAttribute.OpenWarning in v.attributes]
+
+zone_registry = ZoneRegistry(zones)
+zone_registry.add_group("tamper", tamper_zones)
+zone_registry.add_group("home", home_zones)
+zone_registry.add_group("away", away_zones)
 
 codes = dict(config.items("codes"))
 
@@ -611,13 +683,21 @@ if args.log_level:
     logging.getLogger().setLevel(args.log_level)
     logging.info("Log level set to %s", args.log_level)
 
+startup_phase("configuration loaded")
+
+input_engine = InputEngine(GPIO, schedule=runtime.call_later, dispatch=runtime.call_soon)
+
 for gpio_input in inputs.values():
-    GPIO.setup(gpio_input.gpio, GPIO.IN)
+    input_engine.add(gpio_input)
+
+gpio_levels = GpioLevels(GPIO, [o.gpio for o in chain(inputs.values(), outputs.values())])
 
 for gpio_output in outputs.values():
     GPIO.setup(gpio_output.gpio, GPIO.OUT)
     gpio_output.set(False)
 
+startup_phase("GPIO set up")
+
 
 def wrapping_up() -> None:
     for output in outputs.values():
@@ -629,19 +709,32 @@ def wrapping_up() -> None:
 atexit.register(wrapping_up)
 
 
+def terminate(signum: int, frame) -> None:
+    # systemd stops the service with SIGTERM, leave through SystemExit so the atexit handlers run
+    logging.warning("Received %s, exiting", signal.Signals(signum).name)
+    sys.exit(0)
+
+
+signal.signal(signal.SIGTERM, terminate)
+
+
 @dataclass
 class StateData:
     arm_not_ready: bool = None
     auxiliary_voltage: float = None
+    battery_capacity: float = None
     battery_charging: bool = None
     battery_level: int = None
     battery_low: bool = None
+    battery_runtime: float = None
     battery_test_running: bool = None
     battery_voltage: float = None
     system_voltage: float = None
     config: dict[str, bool] = field(default_factory=dict)
     fault: bool = None
+    healthchecks: dict[str, dict] = field(default_factory=dict)
     reboot_required: bool = None
+    serial_link: dict[str, float] = field(default_factory=dict)
     state: str = None
     tamper: bool = None
     temperature: float = None
@@ -660,40 +753,137 @@ class StateData:
         setattr(self, item, value)
 
 
+def state_leaves(data: dict, prefix: str = "", depth: int = 3) -> dict[str, str]:
+    # Flattens state data into topic paths, e.g. zones/door1 or zone_timers/hallway_motion/value.
+    # Dictionaries deeper than depth (like zone timer attributes) are published as one JSON leaf.
+    leaves = {}
+
+    for key, value in data.items():
+        path = f"{prefix}{key}"
+
+        if isinstance(value, dict) and depth > 1:
+            leaves |= state_leaves(value, f"{path}/", depth - 1)
+        else:
+            leaves[path] = json.dumps(value)
+
+    return leaves
+
+
+# Options that can be changed from Home Assistant, config.ini only holds their initial value
+config_defaults = {
+    "walk_test": False,
+    "door_open_warning": True,
+    "door_chime": False,
+    "aux_output1": False,
+    "aux_output2": False
+}
+
+
 class State:
     def __init__(self):
+        restored = state_log.load()
+
+        # A pending or triggered countdown is resumed by main, other states fall back to the last stable one
+        self.resume: Optional[dict] = restored.get("flow") if restored.get("state") in ["pending", "triggered"] else None
+        stable_state = restored.get("stable_state", config.get("system", "state"))
+
         self.data: StateData = StateData(
-            state=config.get("system", "state"),
-            config={
-                "walk_test": config.getboolean("config", "walk_test", fallback=False),
-                "door_open_warning": config.getboolean("config", "door_open_warning", fallback=True),
-                "door_chime": config.getboolean("config", "door_chime", fallback=False),
-                "aux_output1": config.getboolean("config", "aux_output1", fallback=False),
-                "aux_output2": config.getboolean("config", "aux_output2", fallback=False)
-            },
+            state=restored["state"] if self.resume else stable_state,
+            triggered=restored.get("triggered") if self.resume else None,
+            config={option: settings.get("config", option, config.getboolean("config", option, fallback=default))
+                    for option, default in config_defaults.items()},
             zones={k: None for k, v in zones.items()},
             zone_timers={k: {"value": None, "attributes": {"seconds": v.seconds}} for k, v in zone_timers.items()},
         )
         self._lock: threading.Lock = threading.Lock()
         self._faults: list[str] = ["mqtt_connected"]
-        self.blocked: set[Zone] = set()
+        self.blocked: set[Zone] = {zones[k] for k in restored.get("blocked", []) if k in zones}
         self.status: dict[str, bool] = {}
-        self.code_attempts: int = 0
-        self.zones_open: set[Zone] = set()
-        self.notify_timestamps: dict[Zone, time] = {v: time.time() for v in notify_zones}
+        self.code_attempts: int = restored.get("code_attempts", 0)
+        self.zones_open: set[Zone] = {zones[k] for k in restored.get("zones_open", []) if k in zones}
+        self.notify_timestamps: dict[Zone, time] = {v: restored.get("notify", {}).get(v.key, time.time())
+                                                    for v in notify_zones}
+        self.publish_window: float = config.getint("mqtt", "publish_window", fallback=20) / 1000
+        self.publish_stats: dict[str, int] = {"emitted": 0, "coalesced": 0, "suppressed": 0}
+        self._publish_timer: Optional[asyncio.TimerHandle] = None
+        self._published: Optional[str] = None
+        self.delta_topics: bool = config.getboolean("mqtt", "delta_topics", fallback=False)
+        self._published_leaves: dict[str, str] = {}
+
+        for timer_key, timestamp in restored.get("zone_timers", {}).items():
+            if timer_key in zone_timers:
+                zone_timers[timer_key].timestamp = timestamp
+
+        # Inputs are read again when edge detection starts, sensors keep their last report until the next one
+        for zone_key, value in restored.get("zones", {}).items():
+            if zone_key in sensors:
+                zone_registry.set(sensors[zone_key], value)
+                self.data["zones"][zone_key] = value
+
+        self.data["tamper"] = zone_registry.any_active("tamper")
+        self.data["arm_not_ready"] = zone_registry.any_active("away")
+
+    def save(self, sync: bool = False, **changes) -> None:
+        state_log.append(changes, sync)
 
     def json(self) -> str:
         return json.dumps(self.data.__dict__)
 
-    def publish(self) -> None:
-        mqtt_client.publish("home/alarm_test/availability", "online", retain=True)
-        mqtt_client.publish('home/alarm_test', self.json(), retain=True)
+    def publish(self, immediate: bool = False) -> None:
+        # Changes within the publish window are merged into a single payload,
+        # immediate is used for transitions that must not wait for the window.
+        if immediate:
+            if self._publish_timer is not None:
+                self._publish_timer.cancel()
+                self._publish_timer = None
+            self._flush()
+            return
+
+        if self._publish_timer is not None:
+            self.publish_stats["coalesced"] += 1
+            return
+
+        self._publish_timer = runtime.call_later(self.publish_window, self._flush_window)
+
+    def republish(self) -> None:
+        self._published = None
+        self._published_leaves.clear()
+        self.publish(immediate=True)
+
+    def _flush_window(self) -> None:
+        self._publish_timer = None
+        self._flush()
+
+    def _flush(self) -> None:
+        payload = self.json()
+
+        if payload == self._published:
+            self.publish_stats["suppressed"] += 1
+            return
+
+        mqtt_publish("home/alarm_test/availability", "online", retain=True)
+        mqtt_publish('home/alarm_test', payload, retain=True)
+        self._published = payload
+        self.publish_stats["emitted"] += 1
+
+        if self.delta_topics:
+            self._publish_leaves()
 
         if args.print_payload:
             print(json.dumps(self.data.__dict__, indent=2, sort_keys=True))
 
         if args.print_status:
             print(json.dumps(self.status, indent=2, sort_keys=True))
+            print(json.dumps(self.publish_stats, indent=2, sort_keys=True))
+
+    def _publish_leaves(self) -> None:
+        leaves = state_leaves(self.data.__dict__)
+
+        for path, value in leaves.items():
+            if self._published_leaves.get(path) != value:
+                mqtt_publish(f"home/alarm_test/state/{path}", value, retain=True)
+
+        self._published_leaves = leaves
 
     @property
     def system(self) -> str:
@@ -710,6 +900,7 @@ class State:
             # if (state == "armed_away" and self.data["state"] == "triggered") or state == "disarmed":
             if alarm_state in ["disarmed", "armed_home", "armed_away"]:
                 self.code_attempts = 0
+                self.set_status("code_attempts", True)
                 self.data["triggered"] = None
 
                 if len(self.zones_open) > 0:
@@ -717,21 +908,37 @@ class State:
                     self.zones_open.clear()
 
             self.data["state"] = alarm_state
-            self.publish()
+            self.publish(immediate=alarm_state in ["triggered", "pending"])
 
+            changes = {"state": alarm_state, "triggered": self.data["triggered"]}
             if alarm_state in ["disarmed", "armed_home", "armed_away"]:
-                with open('config.ini', 'w') as configfile:
-                    config.set("system", "state", alarm_state)
-                    config.write(configfile)
+                changes |= {"stable_state": alarm_state, "flow": None, "code_attempts": 0, "zones_open": []}
+            self.save(sync=True, **changes)
+
+            # A state change ends the flows driving the other states
+            runtime.cancel(*[flow for flow in ["arming", "pending", "triggered"] if flow != alarm_state])
 
             for panel in [v for k, v in alarm_panels.items() if v.set_states]:
                 panel.set(AlarmState(alarm_state))
 
+        for timer_key, timer in zone_timers.items():
+            if alarm_state in timer.blocked_state:
+                self.zone_timer(timer_key)
+
+    def set_status(self, key: str, value: bool) -> None:
+        if self.status.get(key) == value:
+            return
+
+        self.status[key] = value
+        # Changes within a second are evaluated together
+        runtime.deadline("fault", 1, self.fault, replace=False)
+
     def zone(self, zone_key: str, value: bool) -> None:
         zone = zones[zone_key]
 
-        if self.data["zones"][zone_key] != value:
+        if zone_registry.set(zone, value):
             self.data["zones"][zone_key] = value
+            self.save(zones={zone_key: value})
             logging.info("Zone: %s changed to %s", zone, value)
 
             for timer_key, timer in zone_timers.items():
@@ -740,31 +947,32 @@ class State:
                     self.zone_timer(timer_key)
 
             if value and state.data["config"]["walk_test"]:
-                threading.Thread(target=buzzer_signal, args=(2, [0.2, 0.2])).start()
+                runtime.spawn(None, buzzer_signal, 2, [0.2, 0.2])
 
             if (value and state.data["config"]["door_chime"] and ZoneAttribute.Chime in zone.attributes
-                    and not state.data["config"]["walk_test"] and self.system == "disarmed"
-                    and not door_chime_lock.locked()):
-                threading.Thread(target=door_chime, args=()).start()
+                    and not state.data["config"]["walk_test"] and self.system == "disarmed"):
+                runtime.spawn("door_chime", door_chime)
 
             if value and self.system in ["triggered", "armed_home", "armed_away"]:
-                if zone in notify_zones and (time.time() - self.notify_timestamps[zone] > 180):
-                    pushover.push("Notify zone is open", str(zone), 1)
+                if zone.route.notify and (time.time() - self.notify_timestamps[zone] > 180):
+                    digest.notify("notify", "Notify zone is open", str(zone), 1)
                     self.notify_timestamps[zone] = time.time()
+                    self.save(notify={zone_key: self.notify_timestamps[zone]})
 
-            tamper_zones = {k: v.get() for k, v in zones.items() if v.dev_class == DevClass.Tamper}
-            state.data["tamper"] = any(tamper_zones.values())
+            if zone.route.tamper:
+                self.set_status(zone_key, not value)
 
-            for tamper_key, tamper_status in tamper_zones.items():
-                state.status[f"{tamper_key}"] = not tamper_status
+            if value and ZoneAttribute.OpenWarning in zone.attributes:
+                runtime.spawn("door_open_warning", door_open_warning)
 
-            clear = not any([o.get() for o in away_zones])
-            self.data["arm_not_ready"] = not clear
+            self.data["tamper"] = zone_registry.any_active("tamper")
+            self.data["arm_not_ready"] = zone_registry.any_active("away")
 
             self.publish()
 
         if zone in self.blocked and value is False:
             self.blocked.remove(zone)
+            self.save(blocked=[z.key for z in self.blocked])
             logging.debug("Blocked zones: %s", self.blocked)
 
     def fault(self) -> None:
@@ -778,14 +986,14 @@ class State:
             if faults:
                 faulted_status = ", ".join(faults).upper()
                 logging.error("System check(s) failed: %s", faulted_status)
-                pushover.push("System check(s) failed", faulted_status)
+                digest.notify("fault", "System check(s) failed", faulted_status)
             else:
                 logging.info("System status restored")
-                pushover.push("System status restored", "All checks are OK")
+                digest.notify("fault", "System status restored", "All checks are OK")
 
     def zone_timer(self, timer_key: str) -> None:
         timer = zone_timers[timer_key]
-        timer_zones = [v for k, v in self.data["zones"].items() if k in timer.zones]
+        timer_zones = [self.data["zones"][k] for k in timer.zones]
         # print(json.dumps(timer_zones, indent=2, sort_keys=True))
 
         # if timer.zone_value:
@@ -794,6 +1002,7 @@ class State:
         #    zone_state = not any(timer_zones)
 
         zone_state = any(timer_zones)
+        timestamp = timer.timestamp
 
         if zone_state:
             timer.timestamp = time.time()
@@ -801,12 +1010,21 @@ class State:
         if state.system in timer.blocked_state:
             timer.cancel()
 
+        if timer.timestamp != timestamp:
+            self.save(zone_timers={timer_key: timer.timestamp})
+
         last_msg_s = round(time.time() - timer.timestamp)
         value = last_msg_s < timer.seconds
 
         # if not timer.zone_value:
         #    value = not value
 
+        # Re-evaluate when the timer runs out, unless a zone is still holding it
+        if value and not zone_state:
+            runtime.deadline(f"zone_timer_{timer_key}", timer.seconds - last_msg_s, self.zone_timer, timer_key)
+        else:
+            runtime.cancel_deadline(f"zone_timer_{timer_key}")
+
         if self.data["zone_timers"][timer_key]["value"] != value:
             self.data["zone_timers"][timer_key]["value"] = value
             logging.info("Zone timer: %s changed to %s", timer, value)
@@ -816,176 +1034,183 @@ class State:
             print(f"{timer}: {datetime.timedelta(seconds=timer.seconds-last_msg_s)}")
 
 
-def buzzer(seconds: int, current_state: str) -> bool:
+async def buzzer(seconds: int, current_state: str) -> None:
     logging.info("Buzzer loop started (%d seconds)", seconds)
     start_time = time.time()
 
-    while (start_time + seconds) > time.time():
-        if current_state == "arming":
-            if any([o.get() for o in home_zones]):
-                buzzer_signal(1, [0.2, 0.8])
-            else:
-                buzzer_signal(1, [0.05, 0.95])
+    try:
+        while (start_time + seconds) > time.time():
+            if current_state == "arming":
+                if zone_registry.any_active("home"):
+                    await buzzer_signal(1, [0.2, 0.8])
+                else:
+                    await buzzer_signal(1, [0.05, 0.95])
 
-        if current_state == "pending":
-            if (start_time + (seconds/2)) > time.time():
-                buzzer_signal(1, [0.05, 0.95])
-            else:
-                buzzer_signal(2, [0.05, 0.45])
+            if current_state == "pending":
+                if (start_time + (seconds/2)) > time.time():
+                    await buzzer_signal(1, [0.05, 0.95])
+                else:
+                    await buzzer_signal(2, [0.05, 0.45])
 
-        if state.system != current_state:
-            logging.info("Buzzer loop aborted")
-            return False
+    except asyncio.CancelledError:
+        logging.info("Buzzer loop aborted")
+        raise
 
     logging.info("Buzzer loop completed")
-    return True
 
 
-def buzzer_signal(repeat: int, duration: list[float]) -> None:
-    with buzzer_lock:
-        if len(duration) > 2:
-            time.sleep(duration[2])
-        for _ in range(repeat):
-            outputs["buzzer"].set(True)
-            time.sleep(duration[0])
+async def buzzer_signal(repeat: int, duration: list[float]) -> None:
+    async with buzzer_lock:
+        try:
+            if len(duration) > 2:
+                await asyncio.sleep(duration[2])
+            for _ in range(repeat):
+                outputs["buzzer"].set(True)
+                await asyncio.sleep(duration[0])
+                outputs["buzzer"].set(False)
+                await asyncio.sleep(duration[1])
+        finally:
             outputs["buzzer"].set(False)
-            time.sleep(duration[1])
 
 
-def siren(seconds: int, zone: Zone, current_state: str) -> bool:
+async def siren(seconds: int, zone: Zone) -> None:
     logging.info("Siren loop started (%d seconds, %s, %s)",
-                 seconds, zone, current_state)
+                 seconds, zone, state.system)
     start_time = time.time()
     # zones_open = len(state.zones_open)
 
-    while (start_time + seconds) > time.time():
-        # ANSI S3.41-1990; Temporal Three or T3 pattern
-        # Indoor siren uses about 0.2 seconds to react
-        if zone in fire_zones:
-            for _ in range(3):
+    try:
+        while (start_time + seconds) > time.time():
+            # ANSI S3.41-1990; Temporal Three or T3 pattern
+            # Indoor siren uses about 0.2 seconds to react
+            if zone.route.fire:
+                for _ in range(3):
+                    outputs["siren1"].set(True)
+                    await asyncio.sleep(0.7)
+                    outputs["siren1"].set(False)
+                    await asyncio.sleep(0.3)
+                await asyncio.sleep(1)
+
+            elif zone.route.water:
                 outputs["siren1"].set(True)
-                time.sleep(0.7)
+                await asyncio.sleep(0.5)
                 outputs["siren1"].set(False)
-                time.sleep(0.3)
-            time.sleep(1)
+                await asyncio.sleep(10)
+
+            else:
+                outputs["siren1"].set(True)
+                # outputs["beacon"].set(True)
 
-        elif zone in water_zones:
-            outputs["siren1"].set(True)
-            time.sleep(0.5)
-            outputs["siren1"].set(False)
-            time.sleep(10)
+                if ((time.time()-start_time) > (seconds/3) and len(state.zones_open) > 1) or zone.route.direct:
+                    outputs["siren2"].set(True)
+                await asyncio.sleep(1)
 
-        else:
-            outputs["siren1"].set(True)
-            # outputs["beacon"].set(True)
-
-            if ((time.time()-start_time) > (seconds/3) and len(state.zones_open) > 1) or zone in direct_zones:
-                outputs["siren2"].set(True)
-            time.sleep(1)
-
-        if state.system != current_state:
-            outputs["siren1"].set(False)
-            outputs["siren2"].set(False)
-            # outputs["beacon"].set(False)
-            logging.info("Siren loop aborted")
-
-            return False
-
-        # if len(state.zones_open) > zones_open:
-        #    logging.warning("Open triggered zones increased, extending trigger time")
-        #    logging.debug("Trigger time increased by: %d seconds", time.time() - start_time)
-        #    start_time = time.time()
-        #    zones_open = len(state.zones_open)
-
-    outputs["siren1"].set(False)
-    outputs["siren2"].set(False)
-    # outputs["beacon"].set(False)
-    logging.info("Siren loop completed")
+            # if len(state.zones_open) > zones_open:
+            #    logging.warning("Open triggered zones increased, extending trigger time")
+            #    logging.debug("Trigger time increased by: %d seconds", time.time() - start_time)
+            #    start_time = time.time()
+            #    zones_open = len(state.zones_open)
 
-    return True
+    except asyncio.CancelledError:
+        logging.info("Siren loop aborted")
+        raise
 
+    finally:
+        outputs["siren1"].set(False)
+        outputs["siren2"].set(False)
+        # outputs["beacon"].set(False)
 
-def arming(user: str) -> None:
+    logging.info("Siren loop completed")
+
+
+async def arming(user: str) -> None:
     state.system = "arming"
     arming_time = config.getint("times", "arming")
 
     if args.silent:
         arming_time = 10
 
-    if buzzer(arming_time, "arming"):
-        active_away_zones1 = [o.label for o in away_zones if o.get() and o.dev_class != DevClass.Motion]
-        active_away_zones2 = [o for o in away_zones if o.get() and o.dev_class == DevClass.Motion]
+    await buzzer(arming_time, "arming")
 
-        if active_away_zones1:
-            logging.error("Arm away failed, not clear: %s", active_away_zones1)
+    active_away_zones = zone_registry.active_zones("away")
+    active_away_zones1 = [o.label for o in active_away_zones if o.dev_class != DevClass.Motion]
+    active_away_zones2 = [o for o in active_away_zones if o.dev_class == DevClass.Motion]
 
-            active_away_zones1_str = ", ".join(active_away_zones1)
-            pushover.push("Arm away failed", f"Not clear: {active_away_zones1_str}", 1, {"sound": "siren"})
+    if active_away_zones1:
+        logging.error("Arm away failed, not clear: %s", active_away_zones1)
 
-            state.system = "disarmed"
-            buzzer_signal(1, [1, 0])
-            return
+        active_away_zones1_str = ", ".join(active_away_zones1)
+        pushover.push("Arm away failed", f"Not clear: {active_away_zones1_str}", 1, {"sound": "siren"})
+
+        state.system = "disarmed"
+        await buzzer_signal(1, [1, 0])
+        return
 
-        if active_away_zones2:
-            state.blocked.update(active_away_zones2)
-            logging.warning("Suppressed zones: %s", state.blocked)
+    if active_away_zones2:
+        state.blocked.update(active_away_zones2)
+        state.save(blocked=[z.key for z in state.blocked])
+        logging.warning("Suppressed zones: %s", state.blocked)
 
-            active_away_zones2_str = ", ".join([o.label for o in active_away_zones2])
-            pushover.push("Away zone(s) not clear", f"Suppressed: {active_away_zones2_str}")
+        active_away_zones2_str = ", ".join([o.label for o in active_away_zones2])
+        pushover.push("Away zone(s) not clear", f"Suppressed: {active_away_zones2_str}")
 
-        state.system = "armed_away"
-        pushover.push("System armed away", f"User: {user}")
+    state.system = "armed_away"
+    pushover.push("System armed away", f"User: {user}")
 
 
-def pending(current_state: str, zone: Zone) -> None:
+async def pending(current_state: str, zone: Zone, elapsed: float = 0) -> None:
     delay_time = config.getint("times", "delay")
 
     if args.silent:
         delay_time = 10
 
-    with pending_lock:
-        state.system = "pending"
-        logging.info("Pending because of zone: %s", zone)
+    state.system = "pending"
+    state.save(sync=True, flow={"name": "pending", "started": time.time() - elapsed,
+                                "current_state": current_state, "zone": zone.key})
+    logging.info("Pending because of zone: %s", zone)
 
-        if buzzer(delay_time, "pending"):
-            triggered(current_state, zone)
+    await buzzer(delay_time - elapsed, "pending")
+    runtime.spawn("triggered", triggered, current_state, zone, max(elapsed - delay_time, 0))
 
 
-def triggered(current_state: str, zone: Zone) -> None:
+async def triggered(current_state: str, zone: Zone, elapsed: float = 0) -> None:
     trigger_time = config.getint("times", "trigger")
 
     if args.silent:
         trigger_time = 30
 
-    with triggered_lock:
-        if zone in fire_zones:
-            state.data["triggered"] = "Fire"
-        elif zone in water_zones:
-            state.data["triggered"] = "Water leak"
-        elif zone in direct_zones:
-            state.data["triggered"] = "Emergency"
-        else:
-            state.data["triggered"] = "Intrusion"
+    if zone.route.fire:
+        state.data["triggered"] = "Fire"
+    elif zone.route.water:
+        state.data["triggered"] = "Water leak"
+    elif zone.route.direct:
+        state.data["triggered"] = "Emergency"
+    else:
+        state.data["triggered"] = "Intrusion"
 
-        state.system = "triggered"
-        logging.warning("Triggered because of %s, zone: %s", state.data.triggered, zone)
-        pushover.push(state.data.triggered, str(zone), 2)
+    state.system = "triggered"
+    logging.warning("Triggered because of %s, zone: %s", state.data.triggered, zone)
+    # Queued after this step, the first step of siren() below turns the outputs on
+    runtime.call_soon(pushover.push, state.data.triggered, str(zone), 2)
 
-        state.blocked.add(zone)
-        logging.debug("Blocked zones: %s", state.blocked)
+    state.blocked.add(zone)
+    state.save(sync=True, blocked=[z.key for z in state.blocked],
+               flow={"name": "triggered", "started": time.time() - elapsed, "current_state": current_state,
+                     "zone": zone.key})
+    logging.debug("Blocked zones: %s", state.blocked)
 
-        if siren(trigger_time, zone, "triggered"):
-            state.system = current_state
+    await siren(trigger_time - elapsed, zone)
+    state.system = current_state
 
 
-def disarmed(user: str) -> None:
+async def disarmed(user: str) -> None:
     state.system = "disarmed"
     pushover.push("System disarmed", f"User: {user}")
-    buzzer_signal(2, [0.05, 0.15])
+    await buzzer_signal(2, [0.05, 0.15])
 
 
-def armed_home(user: str) -> None:
-    active_home_zones = [o.label for o in home_zones if o.get()]
+async def armed_home(user: str) -> None:
+    active_home_zones = [o.label for o in zone_registry.active_zones("home")]
 
     if active_home_zones:
         logging.error("Arm home failed, not clear: %s", active_home_zones)
@@ -994,131 +1219,341 @@ def armed_home(user: str) -> None:
         pushover.push("Arm home failed", f"Not clear: {active_home_zones_str}", 1, {"sound": "siren"})
 
         state.system = "disarmed"
-        buzzer_signal(1, [1, 0])
+        await buzzer_signal(1, [1, 0])
         return
 
     state.system = "armed_home"
     pushover.push("System armed home", f"User: {user}")
-    buzzer_signal(1, [0.05, 0.05])
+    await buzzer_signal(1, [0.05, 0.05])
 
 
-def water_alarm() -> None:
-    with water_alarm_lock:
-        water_alarm_time = time.time()
-        logging.warning("Entered water alarm lock!")
+async def water_alarm() -> None:
+    water_alarm_time = time.time()
+    logging.warning("Entered water alarm!")
 
-        arduino.commands.put([3, True])  # Water valve relay
-        arduino.commands.put([4, True])  # Dishwasher relay (NC)
+    arduino.set_output(3, True)  # Water valve relay
+    arduino.set_output(4, True)  # Dishwasher relay (NC)
 
-        # Keep in loop until manually reset
-        while not arduino.data.inputs[4]:
-            if math.floor(time.time() - water_alarm_time) % 30 == 0:
-                buzzer_signal(1, [0.5, 0.5])
-                buzzer_signal(2, [0.1, 0.2])
-            else:
-                time.sleep(1)
+    # Keep in loop until manually reset
+    while not arduino.data.inputs[4]:
+        if math.floor(time.time() - water_alarm_time) % 30 == 0:
+            await buzzer_signal(1, [0.5, 0.5])
+            await buzzer_signal(2, [0.1, 0.2])
+        else:
+            await asyncio.sleep(1)
 
-        logging.info("Leaving water alarm lock.")
+    logging.info("Leaving water alarm.")
 
-        # Turn water back on if manual switch enabled
-        if arduino.data.inputs[3]:
-            arduino.commands.put([3, False])  # Water valve relay
+    # Turn water back on if manual switch enabled
+    if arduino.data.inputs[3]:
+        arduino.set_output(3, False)  # Water valve relay
 
-        arduino.commands.put([4, False])  # Dishwasher relay (NC)
+    arduino.set_output(4, False)  # Dishwasher relay (NC)
 
 
-def run_led() -> None:
+async def run_led() -> None:
     while True:
         run_led_output = "led_red" if state.data["fault"] else "led_green"
 
         if state.system == "disarmed":
-            time.sleep(1.5)
+            await asyncio.sleep(1.5)
         else:
-            time.sleep(0.5)
+            await asyncio.sleep(0.5)
 
         outputs[run_led_output].set(True)
-        time.sleep(0.5)
+        await asyncio.sleep(0.5)
         outputs[run_led_output].set(False)
 
 
 def check_zone(zone: Zone) -> None:
-    if zone in fire_zones or (state.system != "armed_away" and zone in direct_zones):
-        if not triggered_lock.locked():
-            threading.Thread(target=triggered, args=(state.system, zone,)).start()
+    if zone.route.fire or (state.system != "armed_away" and zone.route.direct):
+        runtime.spawn("triggered", triggered, state.system, zone)
 
-    if zone in water_zones:
-        if not triggered_lock.locked():
-            threading.Thread(target=water_alarm, args=()).start()
-            threading.Thread(target=triggered, args=(state.system, zone,)).start()
+    if zone.route.water:
+        if not runtime.running("triggered"):
+            runtime.spawn("water_alarm", water_alarm)
+            runtime.spawn("triggered", triggered, state.system, zone)
 
     if zone in state.blocked:
         return
 
-    if state.system in ["armed_away", "pending"] and zone in away_zones:
-        if ArmMode.AwayDelayed in zone.arm_modes and not pending_lock.locked():
-            threading.Thread(target=pending, args=("armed_away", zone,)).start()
-        if ArmMode.Away in zone.arm_modes and not triggered_lock.locked():
-            threading.Thread(target=triggered, args=("armed_away", zone,)).start()
+    if state.system in ["armed_away", "pending"] and zone.route.away:
+        if zone.route.away_delayed:
+            runtime.spawn("pending", pending, "armed_away", zone)
+        if zone.route.away_instant:
+            runtime.spawn("triggered", triggered, "armed_away", zone)
 
-    if state.system == "armed_home" and zone in home_zones:
-        if not triggered_lock.locked():
-            threading.Thread(target=triggered, args=("armed_home", zone,)).start()
+    if state.system == "armed_home" and zone.route.home:
+        runtime.spawn("triggered", triggered, "armed_home", zone)
 
-    if state.system in ["armed_away", "pending", "triggered"] and zone in away_zones:
+    if state.system in ["armed_away", "pending", "triggered"] and zone.route.away:
         zones_open_count = len(state.zones_open)
         state.zones_open.add(zone)
 
         if len(state.zones_open) > zones_open_count:
+            state.save(zones_open=[z.key for z in state.zones_open])
             logging.info("Added zone to list of open zones: %s", zone)
             if len(state.zones_open) > 1 and state.system == "triggered":
                 zones_open_str = ", ".join([o.label for o in state.zones_open])
-                pushover.push("Multiple zones triggered", zones_open_str, 1)
+                digest.notify("zones_open", "Multiple zones triggered", zones_open_str, 1)
 
 
-# The callback for when the client receives a CONNACK response from the server.
-def on_connect(client: mqtt.Client, userdata, flags: dict[str, int], rc: int) -> None:
-    logging.info("Connected to MQTT broker with result code %s", rc)
+def on_bridge_state(y: dict, msg: mqtt.MQTTMessage) -> None:
+    if "state" not in y:
+        return
 
-    # Subscribing in on_connect() means that if we lose the connection and
-    # reconnect then subscriptions will be renewed.
+    state.set_status("zigbee_bridge", y["state"] == "online")
+    state.data["zigbee_bridge"] = state.status["zigbee_bridge"]
+
+
+def on_config(y: dict, msg: mqtt.MQTTMessage) -> None:
+    if not all(k in y for k in ("option", "value")):
+        return
+
+    cfg_option = y["option"]
+    cfg_value = y["value"]
+
+    settings.set("config", cfg_option, cfg_value)
+    logging.info("Config option: %s changed to %s", cfg_option, cfg_value)
+    state.data["config"][cfg_option] = cfg_value
+    state.publish()
+
+    if cfg_option == "door_open_warning" and cfg_value:
+        runtime.spawn("door_open_warning", door_open_warning)
+
+
+def on_action(y: dict, msg: mqtt.MQTTMessage) -> None:
+    if not all(k in y for k in ("option", "value")):
+        return
+
+    act_option = y["option"]
+    act_value = y["value"]
+
+    logging.info("Action triggered: %s, with value: %s", act_option, act_value)
+
+    if act_option == "siren_test" and act_value:
+        # Runs as the triggered flow, so real triggers wait and the siren watchdog accepts it
+        runtime.spawn("triggered", siren_test)
+
+    if act_option == "zone_timer_cancel" and act_value in zone_timers:
+        timer = zone_timers[act_value]
+        timer.cancel()
+        state.zone_timer(act_value)
+
+    if act_option == "battery_test" and act_value:
+        if not runtime.spawn("battery_test", battery_test):
+            logging.error("Battery test already running!")
+
+    if act_option == "water_valve_test" and act_value:
+        if not runtime.spawn("water_valve_test", water_valve_test):
+            logging.error("Water valve test already running!")
+
+    if act_option == "water_alarm_test" and act_value:
+        if water_zones:
+            runtime.spawn(None, alarm_test, random.choice(water_zones))  # use random water sensor to test
+        else:
+            logging.error("No water zones defined, unable to run water alarm test!")
+
+    if act_option == "fire_alarm_test" and act_value:
+        if fire_zones:
+            runtime.spawn(None, alarm_test, random.choice(fire_zones))  # use random fire sensor to test
+        else:
+            logging.error("No fire zones defined, unable to run fire alarm test!")
+
+    if act_option == "water_valve_set":
+        arduino.set_output(3, not act_value)
+        # logging.info("Water valve action: %s", act_value)
+
+
+async def siren_test() -> None:
+    # arduino.set_output(1, True) # Siren block relay
+    await buzzer_signal(7, [0.1, 0.9])
+    await buzzer_signal(1, [2.5, 0.5])
+
+    if tamper_zones and len(zones) > 2:
+        state.zones_open.update(list(zones.values())[:2])
+        await siren(3, tamper_zones[0])  # use first tamper zone to test
+        # state.zones_open.clear()
+    else:
+        logging.error("Not enough zones defined, unable to run siren test!")
+    # arduino.set_output(1, False) # Siren block relay
+
+
+async def alarm_test(zone: Zone) -> None:
+    await buzzer_signal(7, [0.1, 0.9])
+    await buzzer_signal(1, [2.5, 0.5])
+    check_zone(zone)
+
+
+def on_panel_message(panel: AlarmPanel, y: dict, msg: mqtt.MQTTMessage) -> None:
+    device_seen(panel)
+
+    if "battery" in y:
+        if isinstance(y["battery"], (int, float)):
+            # logging.debug("Found battery level %s on panel %s", y["battery"], panel)
+            state.set_status(f"{panel.label.replace(' ', '_')}_bat", int(y["battery"]) > 20)
+
+    if "linkquality" in y:
+        if isinstance(y["linkquality"], (int, float)):
+            # logging.debug("Found link quality %s on panel %s", y["linkquality"], panel)
+            lqi = panel.linkquality.update(int(y["linkquality"]))
+
+            if len(panel.linkquality) > 1:
+                state.set_status(f"{panel.label.replace(' ', '_')}_lqi", lqi > 0)
+
+    if panel.fields["action"] not in y:
+        return
+
+    action = y[panel.fields["action"]]
+    code = y.get(panel.fields["code"])
+    code_str = str(code).lower()
+    action_transaction = y.get("action_transaction")
+
+    if msg.retain == 1:
+        logging.warning("Discarding action: %s, in retained message from alarm panel: %s", action, panel)
+        return
+
+    # if panel.emergency and action == panel.emergency:
+    #    logging.warning(f"Emergency from panel: {panel.label}")
+
+    if code_str in codes:
+        user = codes[code_str]
+        logging.info("Panel action, %s: %s by %s (%s)", panel, action, user, action_transaction)
+
+        if action == panel.actions[AlarmPanelAction.Disarm]:
+            if state.system == "disarmed":
+                panel.validate(action_transaction, AlarmPanelAction.AlreadyDisarmed)
+            else:
+                panel.validate(action_transaction, AlarmPanelAction.Disarm)
+                runtime.spawn(None, disarmed, user)
+
+        elif action == panel.actions[AlarmPanelAction.ArmAway]:
+            panel.validate(action_transaction, AlarmPanelAction.ArmAway)
+            runtime.spawn("arming", arming, user)
+
+        elif action == panel.actions[AlarmPanelAction.ArmHome]:
+            if zone_registry.any_active("home"):
+                panel.validate(action_transaction, AlarmPanelAction.NotReady)
+            else:
+                panel.validate(action_transaction, AlarmPanelAction.ArmHome)
+                runtime.spawn(None, armed_home, user)
+
+        else:
+            logging.warning("Unknown action: %s, from alarm panel: %s", action, panel)
+
+    elif code is not None:
+        state.code_attempts += 1
+        state.save(code_attempts=state.code_attempts)
+        state.set_status("code_attempts", state.code_attempts < 3)
+        logging.warning("Invalid code: %s, attempt: %d", code, state.code_attempts)
+        # buzzer_signal(1, [1, 0])
+        panel.validate(action_transaction, AlarmPanelAction.InvalidCode)
+        pushover.push("Invalid code entered", f"Panel: {panel}")
+
+
+def on_sensor_message(sensor: Sensor, y: dict, msg: mqtt.MQTTMessage) -> None:
+    if sensor.field not in y:
+        return
+
+    device_seen(sensor)
 
-    topics = set()
-    topics.add("zigbee2mqtt/bridge/state")
+    state.zone(sensor.key, y[sensor.field] == sensor.value.value)
 
-    for option in ["config", "action"]:
-        topics.add(f"home/alarm_test/{option}")
+    if y[sensor.field] == sensor.value.value:
+        if msg.retain == 1 and (sensor.route.direct or sensor.route.fire):
+            logging.warning("Discarding active sensor: %s, in retained message", sensor)
+            return
+
+        check_zone(sensor)
+
+    if "battery" in y:
+        if isinstance(y["battery"], (int, float)):
+            # logging.debug("Found battery level %s on sensor %s", y["battery"], sensor)
+            state.set_status(f"{sensor.label.replace(' ', '_')}_bat", int(y["battery"]) > 20)
+
+    if "linkquality" in y:
+        if isinstance(y["linkquality"], (int, float)):
+            # logging.debug("Found link quality %s on sensor %s", y["linkquality"], sensor)
+            sensor.linkquality.update(int(y["linkquality"]))
 
+            # if len(sensor.linkquality) > 1:
+            #     state.status[f"{sensor.label.replace(' ', '_')}_lqi"] = sensor.linkquality.value > 0
+
+
+def build_topic_handlers() -> dict[str, list[Callable[[dict, mqtt.MQTTMessage], None]]]:
+    handlers: dict[str, list[Callable[[dict, mqtt.MQTTMessage], None]]] = {
+        "zigbee2mqtt/bridge/state": [on_bridge_state],
+        "home/alarm_test/config": [on_config],
+        "home/alarm_test/action": [on_action],
+    }
+
+    # Panels go before sensors, a panel topic can also carry an emergency sensor
     for panel in alarm_panels.values():
-        topics.add(panel.topic)
+        handlers.setdefault(panel.topic, []).append(partial(on_panel_message, panel))
 
     for sensor in sensors.values():
-        topics.add(sensor.topic)
+        handlers.setdefault(sensor.topic, []).append(partial(on_sensor_message, sensor))
+
+    return handlers
+
+
+topic_handlers = build_topic_handlers()
+
+
+# The callback for when the client receives a CONNACK response from the server.
+def on_connect(client: mqtt.Client, userdata, flags: dict[str, int], rc: int) -> None:
+    global topic_handlers
+    logging.info("Connected to MQTT broker with result code %s", rc)
 
-    topic_tuples = [(topic, 0) for topic in topics]
+    # Subscribing in on_connect() means that if we lose the connection and
+    # reconnect then subscriptions will be renewed.
+
+    topic_handlers = build_topic_handlers()
+
+    topic_tuples = [(topic, 0) for topic in topic_handlers]
     logging.debug("Topics: %s", topic_tuples)
 
     client.subscribe(topic_tuples)
 
     if rc == 0:
+        if not hasattr(client, "connected_flag"):
+            startup_phase("MQTT connected")
         client.connected_flag = True
-        state.status["mqtt_connected"] = True
-        hass.discovery(client, zones, zone_timers)
+        runtime.call_soon(state.set_status, "mqtt_connected", True)
+        discovery.requested = True
+        runtime.call_soon(runtime.spawn, "hass_discovery", hass_discovery)
+        runtime.call_soon(state.republish)
     else:
         client.bad_connection_flag = True
         print("Bad connection, returned code: ", str(rc))
 
 
+async def hass_discovery() -> None:
+    # A reconnect while publishing asks for another round
+    while discovery.requested:
+        discovery.requested = False
+        await discovery.publish(mqtt_client)
+
+
 def on_disconnect(client: mqtt.Client, userdata, rc: int) -> None:
     logging.warning("Disconnecting reason %s", rc)
     client.connected_flag = False
-    state.status["mqtt_connected"] = False
+    runtime.call_soon(state.set_status, "mqtt_connected", False)
     client.disconnect_flag = True
 
 
 # The callback for when a PUBLISH message is received from the server.
 def on_message(client: mqtt.Client, userdata, msg: mqtt.MQTTMessage) -> None:
+    runtime.call_soon(handle_message, msg)
+
+
+def handle_message(msg: mqtt.MQTTMessage) -> None:
     logging.debug("Received message: %s %s", msg.topic, msg.payload.decode('utf-8'))
 
+    handlers = topic_handlers.get(msg.topic)
+    if handlers is None:
+        return
+
     if msg.payload.decode('utf-8') == "":
         logging.warning("Received empty payload, discarded")
         return
@@ -1129,289 +1564,155 @@ def on_message(client: mqtt.Client, userdata, msg: mqtt.MQTTMessage) -> None:
         y = {"value": msg.payload.decode('utf-8')}
         logging.debug("Unable to decode JSON, created object %s", y)
 
-    if msg.topic == "zigbee2mqtt/bridge/state" and "state" in y:
-        state.status["zigbee_bridge"] = y["state"] == "online"
-        state.data["zigbee_bridge"] = state.status["zigbee_bridge"]
-        return
+    for handler in handlers:
+        handler(y, msg)
 
-    if msg.topic == "home/alarm_test/config" and all(k in y for k in ("option", "value")):
-        cfg_option = y["option"]
-        cfg_value = y["value"]
 
-        with open('config.ini', 'w') as configfile:
-            config.set('config', cfg_option, str(cfg_value))
-            config.write(configfile)
+def device_seen(device: Sensor | AlarmPanel) -> None:
+    device.timestamp = time.time()
 
-        logging.info("Config option: %s changed to %s", cfg_option, cfg_value)
-        state.data["config"][cfg_option] = cfg_value
-        state.publish()
+    if device.timeout == 0:
         return
 
-    if msg.topic == "home/alarm_test/action" and all(k in y for k in ("option", "value")):
-        act_option = y["option"]
-        act_value = y["value"]
-
-        logging.info("Action triggered: %s, with value: %s", act_option, act_value)
-
-        if act_option == "siren_test" and act_value:
-            # arduino.commands.put([1, True]) # Siren block relay
-            with pending_lock:
-                buzzer_signal(7, [0.1, 0.9])
-                buzzer_signal(1, [2.5, 0.5])
-            with triggered_lock:
-                siren_test_zones = [v for k, v in zones.items() if v.dev_class == DevClass.Tamper]
-                if siren_test_zones and len(zones) > 2:
-                    state.zones_open.update(list(zones.values())[:2])
-                    siren(3, siren_test_zones[0], "disarmed")  # use first tamper zone to test
-                    # state.zones_open.clear()
-                else:
-                    logging.error("Not enough zones defined, unable to run siren test!")
-            # arduino.commands.put([1, False]) # Siren block relay
-
-        if act_option == "zone_timer_cancel" and act_value in zone_timers:
-            timer = zone_timers[act_value]
-            timer.cancel()
+    device_key = device.label.replace(' ', '_')
+    state.set_status(f"{device_key}_timeout", True)
+    state.set_status(f"{device_key}_lost", True)
+    runtime.deadline(f"{device_key}_timeout", device.timeout * 1.1, state.set_status, f"{device_key}_timeout", False)
+    runtime.deadline(f"{device_key}_lost", device.timeout * 5, state.set_status, f"{device_key}_lost", False)
 
-        if act_option == "battery_test" and act_value:
-            if not battery_test_lock.locked():
-                threading.Thread(target=battery_test, args=(), daemon=True).start()
-            else:
-                logging.error("Battery test already running!")
 
-        if act_option == "water_valve_test" and act_value:
-            if not water_valve_test_lock.locked():
-                threading.Thread(target=water_valve_test, args=()).start()
-            else:
-                logging.error("Water valve test already running!")
-
-        if act_option == "water_alarm_test" and act_value:
-            with pending_lock:
-                buzzer_signal(7, [0.1, 0.9])
-                buzzer_signal(1, [2.5, 0.5])
-            if water_zones:
-                check_zone(random.choice(water_zones))  # use random water sensor to test
-            else:
-                logging.error("No water zones defined, unable to run water alarm test!")
-
-        if act_option == "fire_alarm_test" and act_value:
-            with pending_lock:
-                buzzer_signal(7, [0.1, 0.9])
-                buzzer_signal(1, [2.5, 0.5])
-            if water_zones:
-                check_zone(random.choice(fire_zones))  # use random fire sensor to test
-            else:
-                logging.error("No fire zones defined, unable to run fire alarm test!")
+def healthchecks_result(check: str, ok: bool) -> None:
+    # Called from the healthchecks thread
+    if check == "heartbeat":
+        runtime.call_soon(state.set_status, "healthchecks", ok)
 
-        if act_option == "water_valve_set":
-            arduino.commands.put([3, not act_value])
-            # logging.info("Water valve action: %s", act_value)
 
+async def heartbeat_ping() -> None:
+    if not healthchecks.ping("heartbeat"):
+        logging.debug("Healthchecks UUID not found, aborting ping.")
         return
 
-    for key, panel in alarm_panels.items():
-        if msg.topic == panel.topic:
-            panel.timestamp = time.time()
-
-            if "battery" in y:
-                if isinstance(y["battery"], (int, float)):
-                    # logging.debug("Found battery level %s on panel %s", y["battery"], panel)
-                    state.status[f"{panel.label.replace(' ', '_')}_bat"] = int(y["battery"]) > 20
-
-            if "linkquality" in y:
-                if isinstance(y["linkquality"], (int, float)):
-                    # logging.debug("Found link quality %s on panel %s", y["linkquality"], panel)
-                    panel.linkquality.append(int(y["linkquality"]))
-
-                    if len(panel.linkquality) > 10:
-                        panel.linkquality.pop(0)
-
-                    if len(panel.linkquality) > 1:
-                        state.status[f"{panel.label.replace(' ', '_')}_lqi"] = statistics.median(panel.linkquality) > 0
-                        # print(panel.linkquality, statistics.median(panel.linkquality), statistics.stdev(panel.linkquality))
-
-        if msg.topic == panel.topic and panel.fields["action"] in y:
-            action = y[panel.fields["action"]]
-            code = y.get(panel.fields["code"])
-            code_str = str(code).lower()
-            action_transaction = y.get("action_transaction")
-
-            if msg.retain == 1:
-                logging.warning("Discarding action: %s, in retained message from alarm panel: %s", action, panel)
-                continue
-
-            # if panel.emergency and action == panel.emergency:
-            #    logging.warning(f"Emergency from panel: {panel.label}")
-
-            if code_str in codes:
-                user = codes[code_str]
-                logging.info("Panel action, %s: %s by %s (%s)", panel, action, user, action_transaction)
-
-                if action == panel.actions[AlarmPanelAction.Disarm]:
-                    if state.system == "disarmed":
-                        panel.validate(action_transaction, AlarmPanelAction.AlreadyDisarmed)
-                    else:
-                        panel.validate(action_transaction, AlarmPanelAction.Disarm)
-                        threading.Thread(target=disarmed, args=(user,)).start()
-
-                elif action == panel.actions[AlarmPanelAction.ArmAway]:
-                    panel.validate(action_transaction, AlarmPanelAction.ArmAway)
-                    threading.Thread(target=arming, args=(user,)).start()
-
-                elif action == panel.actions[AlarmPanelAction.ArmHome]:
-                    if any([o.get() for o in home_zones]):
-                        panel.validate(action_transaction, AlarmPanelAction.NotReady)
-                    else:
-                        panel.validate(action_transaction, AlarmPanelAction.ArmHome)
-                        threading.Thread(target=armed_home, args=(user,)).start()
-
-                else:
-                    logging.warning("Unknown action: %s, from alarm panel: %s", action, panel)
-
-            elif code is not None:
-                state.code_attempts += 1
-                logging.warning("Invalid code: %s, attempt: %d", code, state.code_attempts)
-                # buzzer_signal(1, [1, 0])
-                panel.validate(action_transaction, AlarmPanelAction.InvalidCode)
-                pushover.push("Invalid code entered", f"Panel: {panel}")
-
-    for key, sensor in sensors.items():
-        if msg.topic == sensor.topic and sensor.field in y:
-            sensor.timestamp = time.time()
-
-            state.zone(key, y[sensor.field] == sensor.value.value)
-
-            if y[sensor.field] == sensor.value.value:
-                if msg.retain == 1 and sensor in chain(direct_zones, fire_zones):
-                    logging.warning("Discarding active sensor: %s, in retained message", sensor)
-                    continue
-
-                check_zone(sensor)
-
-            if "battery" in y:
-                if isinstance(y["battery"], (int, float)):
-                    # logging.debug("Found battery level %s on sensor %s", y["battery"], sensor)
-                    state.status[f"{sensor.label.replace(' ', '_')}_bat"] = int(y["battery"]) > 20
-
-            if "linkquality" in y:
-                if isinstance(y["linkquality"], (int, float)):
-                    # logging.debug("Found link quality %s on sensor %s", y["linkquality"], sensor)
-                    sensor.linkquality.append(int(y["linkquality"]))
-
-                    if len(sensor.linkquality) > 10:
-                        sensor.linkquality.pop(0)
+    logging.info("Starting Healthchecks ping with UUID %s", healthchecks.uuids["heartbeat"])
 
-                    # if len(sensor.linkquality) > 1:
-                    #     state.status[f"{sensor.label.replace(' ', '_')}_lqi"] = statistics.median(sensor.linkquality) > 0
-                    #     # print(sensor.linkquality, statistics.median(sensor.linkquality), statistics.stdev(sensor.linkquality))
-
-
-def status_check() -> None:
     while True:
-        for key, device in (sensors.items() | alarm_panels.items()):
-            if device.timeout == 0:
-                continue
-
-            last_msg_s = round(time.time() - device.timestamp)
-            state.status[f"{device.label.replace(' ', '_')}_timeout"] = last_msg_s < (device.timeout * 1.1)
-            state.status[f"{device.label.replace(' ', '_')}_lost"] = last_msg_s < (device.timeout * 5)
-
-        state.status["code_attempts"] = state.code_attempts < 3
-        state.status["arduino_data"] = round(time.time() - arduino.timestamp) < 10
+        await asyncio.sleep(60)
+        healthchecks.ping("heartbeat")
+        state.data["healthchecks"] = {check: dict(status) for check, status in healthchecks.status.items()}
 
-        for key, timer in zone_timers.items():
-            state.zone_timer(key)
 
-        state.fault()
-        time.sleep(1)
+# Smallest change applied to state data, smaller moves are sensor noise
+serial_deadbands = {
+    "battery_voltage": 0.02,
+    "aux12_voltage": 0.02,
+    "system_voltage": 0.02,
+    "temperature": 0.2
+}
 
 
-def heartbeat_ping() -> None:
-    hc_uuid = config.get("healthchecks.uuid", "heartbeat", fallback=None)
-    hc_heartbeat = HealthChecks(hc_uuid)
+async def serial_data() -> None:
+    water_valve_switch = True
+    data_ready = asyncio.Event()
+    arduino.on_data = lambda: runtime.call_soon(data_ready.set)
+    applied: dict[str, float] = {}
+    applied_io: Optional[tuple] = None
 
-    if not hc_uuid:
-        logging.debug("Healthchecks UUID not found, aborting ping.")
-        return
+    while True:
+        await data_ready.wait()
+        data_ready.clear()
+        data = arduino.data  # snapshot, never changed once published by the reader
 
-    logging.info("Starting Healthchecks ping with UUID %s", hc_uuid)
+        state.set_status("arduino_data", True)
+        runtime.deadline("arduino_data", 10, state.set_status, "arduino_data", False)
 
-    while True:
-        hc_status = hc_heartbeat.ping()
-        state.status["healthchecks"] = hc_status
+        if args.print_serial:
+            print(arduino.timestamp)
+            print(json.dumps(asdict(data), indent=2, sort_keys=True))
+            print(f"Command latency: {arduino.command_latency}")
 
-        time.sleep(60)
+        # Filters and analytics see every sample, the deadbands only hold back state changes
+        charging = data.battery_voltage > 13 and not data.outputs[1]
+        state.data["battery_level"] = battery.level(data.battery_voltage)
+        battery_analytics.record(data.battery_voltage, state.data["battery_level"], data.temperature, charging)
+        state.data["battery_runtime"] = battery_analytics.runtime(state.data["battery_level"])
 
+        # Follows config changes right away, only asks again once an earlier request is no longer waiting
+        if data.outputs[4] != state.data["config"]["aux_output1"] and 5 not in arduino.pending:
+            arduino.set_output(5, state.data["config"]["aux_output1"])
+        if data.outputs[5] != state.data["config"]["aux_output2"] and 6 not in arduino.pending:
+            arduino.set_output(6, state.data["config"]["aux_output2"])
 
-def serial_data() -> None:
-    water_valve_switch = True
+        moved = {key for key, deadband in serial_deadbands.items()
+                 if key not in applied or abs(getattr(data, key) - applied[key]) >= deadband}
+        io_changed = (data.inputs, data.outputs) != applied_io
 
-    while True:
-        arduino.data_ready.wait()
-        data = arduino.data
+        if not moved and not io_changed:
+            continue
 
-        if args.print_serial:
-            print(arduino.timestamp)
-            print(json.dumps(data.__dict__, indent=2, sort_keys=True))
+        for key in moved:
+            applied[key] = getattr(data, key)
 
-        try:
+        if "temperature" in moved:
             state.data["temperature"] = data.temperature
+            state.set_status("cabinet_temp", data.temperature < 30)
+
+        if "aux12_voltage" in moved:
             state.data["auxiliary_voltage"] = data.aux12_voltage
+            state.set_status("auxiliary_voltage", 12 < data.aux12_voltage < 12.5)
+
+        if "system_voltage" in moved:
             state.data["system_voltage"] = data.system_voltage
+            state.set_status("system_voltage", 4.9 < data.system_voltage < 5.2)
 
+        if "battery_voltage" in moved:
             state.data["battery_voltage"] = data.battery_voltage
-            state.data["battery_level"] = battery.level(data.battery_voltage)
             state.data["battery_low"] = data.battery_voltage < 12
-            state.data["battery_charging"] = data.battery_voltage > 13 and not data.outputs[1]
+            state.set_status("battery_voltage", 12 < data.battery_voltage < 15)
 
-            state.status["auxiliary_voltage"] = 12 < data.aux12_voltage < 12.5
-            state.status["battery_voltage"] = 12 < data.battery_voltage < 15
-            state.status["system_voltage"] = 4.9 < data.system_voltage < 5.2
-            state.status["cabinet_temp"] = data.temperature < 30
+        if not io_changed and "battery_voltage" not in moved:
+            continue
 
-            state.data["water_valve"] = not data.outputs[2]
-
-        except ValueError:
-            logging.error("ValueError on data from Arduino device")
+        applied_io = (data.inputs, data.outputs)
+        state.data["battery_charging"] = charging
+        state.data["water_valve"] = not data.outputs[2]
 
         # state.status["siren1_output"] = outputs["siren1"].get() == data["inputs"][1]
         # state.status["siren2_output"] = outputs["siren2"].get() == data["inputs"][2]
-        state.status["siren_block"] = data.outputs[0] is False
-
-        state.data["battery_test_running"] = battery_test_lock.locked()
+        state.set_status("siren_block", data.outputs[0] is False)
 
-        if data.outputs[4] != state.data["config"]["aux_output1"]:
-            arduino.commands.put([5, state.data["config"]["aux_output1"]])
-        if data.outputs[5] != state.data["config"]["aux_output2"]:
-            arduino.commands.put([6, state.data["config"]["aux_output2"]])
-
-        if data.inputs[3] != water_valve_switch and not water_alarm_lock.locked():
-            arduino.commands.put([3, not data.inputs[3]])
+        if data.inputs[3] != water_valve_switch and not runtime.running("water_alarm"):
+            arduino.set_output(3, not data.inputs[3])
             water_valve_switch = data.inputs[3]
             logging.info("Water valve switch changed state: %s", data.inputs[3])
 
-        arduino.data_ready.clear()
 
-        if round(time.time(), 0) % 10 == 0:
-            state.publish()
+async def publish_serial_data() -> None:
+    # Fixed rate, the next publish is scheduled from the previous deadline so it does not drift
+    interval = config.getfloat("arduino", "publish_interval", fallback=10)
+    next_publish = runtime.loop.time()
 
+    while True:
+        next_publish += interval
+        await asyncio.sleep(next_publish - runtime.loop.time())
+
+        state.data["battery_test_running"] = runtime.running("battery_test")
+        state.data["serial_link"] = {
+            "reconnects": arduino.reconnects,
+            "reconnect_time": arduino.reconnect_time,
+            "dropped_frames": arduino.dropped_frames,
+            "dropped_samples": arduino.dropped_samples
+        }
+        state.publish()
 
-def door_open_warning() -> None:
-    zone_closed_time: dict[str, float] = {}
-    seconds_open_dict: dict[str, int] = {}
 
-    while True:
-        # De Morgan's laws:
-        #   not (A or B) = (not A) and (not B)
-        #   not (A and B) = (not A) or (not B)
-        # If door is closed or warning is disabled
-        for zone in [z for z in zones.values() if ZoneAttribute.OpenWarning in z.attributes]:
-            if not (zone.get() and state.data["config"]["door_open_warning"]):
-                zone_closed_time[zone.key] = time.time()
+async def door_open_warning() -> None:
+    # Started when a door with open warning opens, ends once all of them are closed
+    while state.data["config"]["door_open_warning"]:
+        opened = [zone_registry.timestamps[z.index] for z in open_warning_zones if zone_registry.get(z)]
 
-            seconds_open_dict[zone.key] = math.floor(time.time() - zone_closed_time.get(zone.key, time.time()))
+        if not opened:
+            return
 
-        #print(seconds_open_dict, zone_closed_time)
-        seconds_open = max(seconds_open_dict.values())
+        seconds_open = math.floor(time.time() - min(opened))
 
         interval = 20
         if seconds_open > 180:
@@ -1424,64 +1725,87 @@ def door_open_warning() -> None:
             interval = 15
 
         if state.system == "disarmed" and seconds_open > 30 and seconds_open % interval == 0:
-            buzzer_signal(1, [0.05, 0.95])
+            await buzzer_signal(1, [0.05, 0.95])
         else:
-            time.sleep(1)
+            await asyncio.sleep(1)
 
 
-def battery_test() -> None:
-    with battery_test_lock:
-        hc_battery_test = HealthChecks(config.get("healthchecks.uuid", "battery_test", fallback=None))
+async def arduino_output(idx: int, value: bool, timeout: float = 5) -> bool:
+    # Wait until the Arduino reports the output changed
+    try:
+        latency = await asyncio.wait_for(asyncio.wrap_future(arduino.set_output(idx, value)), timeout)
+    except (asyncio.TimeoutError, RuntimeError) as e:
+        logging.warning("Arduino output %d not confirmed %s: %s", idx, value, e or "timeout")
+        return False
 
-        arduino.commands.put([2, True])  # Disable charger
-        arduino.commands.join()
+    logging.debug("Arduino output %d confirmed %s after %.3f s", idx, value, latency)
+    return True
 
-        hc_battery_test.start()
-        start_time = time.time()
-        battery_log.info("Battery test started at %s V", arduino.data.battery_voltage)
 
-        while state.data["battery_level"] >= 50:
-            time.sleep(1)
+async def battery_test() -> None:
+    if not await arduino_output(2, True):  # Disable charger
+        logging.error("Charger not disabled, battery test aborted")
+        arduino.set_output(2, False)
+        return
 
-        hc_battery_test.stop()
-        test_time = round(time.time() - start_time, 0)
-        battery_log.info("Battery test completed at %s V and %s %%, took: %s",
-                         arduino.data.battery_voltage, state.data["battery_level"],
-                         datetime.timedelta(seconds=test_time))
-        pushover.push("Battery test completed", f"Time: {datetime.timedelta(seconds=test_time)}")
-        arduino.commands.put([2, False])  # Re-enable charger
-        arduino.commands.join()
+    healthchecks.start("battery_test")
+    start_time = time.time()
+    battery_log.info("Battery test started at %s V", arduino.data.battery_voltage)
+    battery_analytics.start_test(state.data["battery_level"])
 
+    try:
+        while state.data["battery_level"] >= 50:
+            await asyncio.sleep(1)
+    except asyncio.CancelledError:
+        battery_analytics.cancel_test()
+        raise
+
+    healthchecks.stop("battery_test")
+    test_time = round(time.time() - start_time, 0)
+    result = battery_analytics.finish_test(state.data["battery_level"])
+    state.data["battery_capacity"] = battery_analytics.capacity()
+
+    battery_log.info("Battery test completed at %s V and %s %%, took: %s, rate: %s %%/h, capacity: %s %%",
+                     arduino.data.battery_voltage, state.data["battery_level"],
+                     datetime.timedelta(seconds=test_time), result and result["rate"], state.data["battery_capacity"])
+    pushover.push("Battery test completed", f"Time: {datetime.timedelta(seconds=test_time)}, "
+                                            f"capacity: {state.data['battery_capacity']} %")
+    if not await arduino_output(2, False):  # Re-enable charger
+        logging.error("Charger not re-enabled after battery test")
+
+
+async def water_valve_test() -> None:
+    if arduino.data.outputs[2] or runtime.running("water_alarm"):
+        logging.error("Can not run water valve test if valve is already active or water alarm is triggered")
+        return
 
-def water_valve_test() -> None:
-    with water_valve_test_lock:
-        hc_water_valve = HealthChecks(config.get("healthchecks.uuid", "water_valve_test", fallback=None))
+    healthchecks.start("water_valve_test")
+    logging.info("Water valve test started")
 
-        if arduino.data.outputs[2] or water_alarm_lock.locked():
-            logging.error("Can not run water valve test if valve is already active or water alarm is triggered")
+    for valve_state in [True, False]:
+        if not await arduino_output(3, valve_state):  # Water valve relay
+            logging.error("Water valve test failed, relay not confirmed %s", valve_state)
+            arduino.set_output(3, False)
+            healthchecks.fail("water_valve_test")
             return
+        await asyncio.sleep(1)
 
-        hc_water_valve.start()
-        logging.info("Water valve test started")
+    healthchecks.stop("water_valve_test")
+    logging.info("Water valve test completed")
 
-        for valve_state in [True, False]:
-            arduino.commands.put([3, valve_state])  # Water valve relay
-            arduino.commands.join()
-            time.sleep(1)
 
-        hc_water_valve.stop()
-        logging.info("Water valve test completed")
+async def door_chime() -> None:
+    outputs["door_chime"].set(True)
+    await asyncio.sleep(1)
+    outputs["door_chime"].set(False)
+    await asyncio.sleep(30)
 
 
-def door_chime() -> None:
-    with door_chime_lock:
-        outputs["door_chime"].set(True)
-        time.sleep(1)
-        outputs["door_chime"].set(False)
-        time.sleep(30)
+def input_changed(gpio_input: Input, value: bool) -> None:
+    state.zone(gpio_input.key, value)
 
 
-def check_reboot_required() -> None:
+async def check_reboot_required() -> None:
     while True:
         reboot_is_required = os.path.isfile("/var/run/reboot-required")
         state.data["reboot_required"] = reboot_is_required
@@ -1489,40 +1813,87 @@ def check_reboot_required() -> None:
         if reboot_is_required:
             logging.warning("Reboot required!")
 
-        time.sleep(60*60)
+        await asyncio.sleep(60*60)
 
 
-mqtt_client = mqtt.Client(config.get("mqtt", "client_id"))
-mqtt_client.on_connect = on_connect
-mqtt_client.on_disconnect = on_disconnect
-mqtt_client.on_message = on_message
-mqtt_client.will_set("home/alarm_test/availability", "offline")
+mqtt_client: Optional[mqtt.Client] = None
 
-for attempt in range(5):
-    try:
-        mqtt_client.connect(config.get("mqtt", "host"))
-        mqtt_client.loop_start()
-    except OSError:
-        logging.error("Unable to connect MQTT, retry... (%d)", attempt)
-        time.sleep(attempt*3)
-    else:
-        break
-else:
-    logging.error("Unable to connect MQTT, giving up!")
 
+async def mqtt_connect() -> None:
+    global mqtt_client
+
+    # paho is slow to import on a Pi Zero, keep it off the path to guarded inputs
+    mqtt_module = await asyncio.to_thread(importlib.import_module, "paho.mqtt.client")
+
+    client = mqtt_module.Client(config.get("mqtt", "client_id"))
+    client.on_connect = on_connect
+    client.on_disconnect = on_disconnect
+    client.on_message = on_message
+    client.will_set("home/alarm_test/availability", "offline")
+
+    # The network loop keeps connecting and reconnecting on its own
+    client.connect_async(config.get("mqtt", "host"))
+    client.loop_start()
+    mqtt_client = client
+
+
+def mqtt_publish(topic: str, payload: str, retain: bool = False) -> None:
+    # Until the client exists messages are dropped, on_connect republishes the state
+    if mqtt_client is not None:
+        mqtt_client.publish(topic, payload, retain=retain)
+
+
+settings = Settings(config.get("system", "settings_file", fallback="settings.json"),
+                    config.getint("system", "settings_write_interval", fallback=10))
+atexit.register(settings.flush)
+state_log = StateLog(config.get("system", "state_file", fallback="state.log"))
+atexit.register(state_log.flush)
 state = State()
+startup_phase(f"state restored ({state.system})")
+
 pushover = Pushover(
         config.get("pushover", "token"),
-        config.get("pushover", "user")
+        config.get("pushover", "user"),
+        spool=Spool(config.get("pushover", "spool", fallback="notifications.spool")),
+        max_age=config.getfloat("pushover", "max_age", fallback=12) * 3600
+        )
+
+discovery = hass.Discovery(zones, zone_timers,
+                           delta_topics=config.getboolean("mqtt", "delta_topics", fallback=False),
+                           rate=config.getfloat("mqtt", "discovery_rate", fallback=50))
+
+healthchecks = HealthChecks(
+        dict(config.items("healthchecks.uuid")) if config.has_section("healthchecks.uuid") else {},
+        on_result=healthchecks_result
         )
 
-arduino = Arduino()
-battery = Battery()
+# Seconds during which notifications of a category are merged into one digest
+digest = Digest(pushover.push, runtime.call_later, {
+    "notify": Category(config.getfloat("notifications", "notify_window", fallback=60)),
+    "fault": Category(config.getfloat("notifications", "fault_window", fallback=60), latest=True),
+    "zones_open": Category(config.getfloat("notifications", "zones_open_window", fallback=30), latest=True)
+})
+
+arduino = Arduino(config.get("arduino", "device", fallback="/dev/ttyUSB0"),
+                  config.get("arduino", "protocol", fallback="ascii"),
+                  config.getint("arduino", "baudrate", fallback=9600),
+                  config.getfloat("arduino", "reset_delay", fallback=2))
+
+for channel in arduino.filters:
+    if config.has_option("arduino", f"{channel}_filter"):
+        arduino.filters[channel] = create_filter(config.get("arduino", f"{channel}_filter"))
+
+battery_curve = {int(k): float(v) for k, v in config.items("battery.curve")} if config.has_section("battery.curve") else None
+battery = Battery(config.get("battery", "chemistry", fallback="agm"), battery_curve,
+                  config.getint("battery", "smoothing", fallback=30))
+battery_analytics = BatteryAnalytics(interval=config.getint("battery", "record_interval", fallback=60),
+                                     max_bytes=config.getint("battery", "record_max_bytes", fallback=1024 * 1024))
+state.data["battery_capacity"] = battery_analytics.capacity()
 
 # Since the Arduino resets when DTR is pulled low, the
 # siren block is removed when starting up.
 if args.siren_block_relay:
-    arduino.commands.put([1, True])  # Siren block relay
+    arduino.set_output(1, True)  # Siren block relay
     logging.warning("Sirens blocked, siren block active!")
 
 if args.silent:
@@ -1541,14 +1912,7 @@ if args.silent:
 #         }
 #     }
 
-pending_lock = threading.Lock()
-triggered_lock = threading.Lock()
-buzzer_lock = threading.Lock()
-water_alarm_lock = threading.Lock()
-
-battery_test_lock = threading.Lock()
-water_valve_test_lock = threading.Lock()
-door_chime_lock = threading.Lock()
+buzzer_lock = asyncio.Lock()
 
 logging.info("Arm home zones: %s", home_zones)
 logging.info("Arm away zones: %s", away_zones)
@@ -1563,45 +1927,55 @@ logging.info("Notify zones: %s", notify_zones)
 passive_zones = [v for k, v in zones.items() if not v.arm_modes]
 logging.info("Passive zones: %s", passive_zones)
 
-if __name__ == "__main__":
-    threading.Thread(target=run_led, args=(), daemon=True).start()
 
-    threading.Thread(target=status_check, args=(), daemon=True).start()
+def resume_flow(flow: Optional[dict]) -> None:
+    # Picks up a pending or triggered countdown interrupted by a restart
+    if flow is None or flow.get("zone") not in zones:
+        return
 
-    threading.Thread(target=heartbeat_ping, args=(), daemon=True).start()
+    elapsed = time.time() - flow["started"]
+    logging.warning("Resuming %s flow for zone %s, %d seconds in", flow["name"], zones[flow["zone"]], elapsed)
+    flows = {"pending": pending, "triggered": triggered}
+    runtime.spawn(flow["name"], flows[flow["name"]], flow["current_state"], zones[flow["zone"]], elapsed)
 
-    threading.Thread(target=arduino.get_data, args=(), daemon=True).start()
-    threading.Thread(target=serial_data, args=(), daemon=True).start()
 
-    threading.Thread(target=door_open_warning, args=(), daemon=True).start()
+async def main() -> None:
+    resume_flow(state.resume)
+    input_engine.start(input_changed, check_zone)
+    startup_phase("inputs guarded")
 
-    threading.Thread(target=check_reboot_required, args=(), daemon=True).start()
+    runtime.spawn("mqtt_connect", mqtt_connect)
 
-    input_active_counter: dict[str, int] = {}
+    for task in [run_led, heartbeat_ping, serial_data, publish_serial_data, check_reboot_required]:
+        runtime.spawn(task.__name__, task)
 
-    while True:
-        time.sleep(0.01)  # Wait 10 ms
+    for device in chain(sensors.values(), alarm_panels.values()):
+        device_seen(device)
 
-        # This loop takes less than 100 micro seconds to complete
-        for input_key, gpio_input in inputs.items():
-            state.zone(input_key, gpio_input.get())
+    for timer_key in zone_timers:
+        state.zone_timer(timer_key)
 
-            if input_key not in input_active_counter:
-                input_active_counter[input_key] = 0
+    state.set_status("code_attempts", state.code_attempts < 3)
+    runtime.deadline("arduino_data", 10, state.set_status, "arduino_data", False)
 
-            if gpio_input.is_true:
-                input_active_counter[input_key] += 1
+    while True:
+        await asyncio.sleep(0.25)
 
-                # Debounce zone inputs, must be active for 5 cycles = 50 ms
-                if input_active_counter[input_key] > 5:
-                    check_zone(gpio_input)
-            else:
-                # if input_active_counter[input_key] > 0:
-                #     rpi_gpio_log.debug("Zone: %s was active for %s cycles", gpio_input, input_active_counter[input_key])
-                input_active_counter[input_key] = 0
+        # Zones held active keep being evaluated, like a level triggered input
+        for input_key in list(input_engine.active):
+            check_zone(inputs[input_key])
+
+        levels = gpio_levels.read()
+        input_engine.reconcile(levels)
 
-        if not triggered_lock.locked() and (outputs["siren1"].is_true or outputs["siren2"].is_true):
-            logging.critical("Siren(s) on outside lock!")
+        if not runtime.running("triggered") and (outputs["siren1"].get(levels) or outputs["siren2"].get(levels)):
+            logging.critical("Siren(s) on outside triggered flow!")
             wrapping_up()
 
-            raise SystemError("Siren(s) on outside lock!")
+            raise SystemError("Siren(s) on outside triggered flow!")
+
+
+if __name__ == "__main__":
+    threading.Thread(target=arduino.get_data, args=(), daemon=True).start()
+
+    runtime.run(main)
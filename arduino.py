@@ -1,10 +1,16 @@
 import serial
 import time
+import struct
+import binascii
+import bisect
 import queue
 import threading
 import logging
-import statistics
-from dataclasses import dataclass, field
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from filters import Filter, MovingAverage
 
 '''
 Inputs:
@@ -26,86 +32,294 @@ Outputs:
 Note:
 Inputs and outputs are read starting at 0, while outputs are changed starting at 1.
 Meaning output 1 is read as output[0] but changed with "o,1,x".
+
+Output changes are acknowledged by the outputs reported in the following samples,
+set_output returns a future that resolves with the latency once the MCU reports the new value.
 '''
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class ArduinoData:
+    # Immutable snapshot, the reader thread swaps in a new one per sample
     battery_voltage: float = None
     aux12_voltage: float = None
     system_voltage: float = None
     temperature: float = None
-    inputs: list[bool] = field(default_factory=list)
-    outputs: list[bool] = field(default_factory=list)
+    inputs: tuple[bool, ...] = ()
+    outputs: tuple[bool, ...] = ()
+
+
+# Binary framing: sync (2) | payload length (1) | payload | CRC-16/CCITT of payload (2, little endian)
+FRAME_SYNC = b"\xa5\x5a"
+FRAME_SAMPLE = 0x01   # MCU -> host, sample_frame
+FRAME_REQUEST = 0x02  # host -> MCU, ask for one sample
+FRAME_OUTPUT = 0x03   # host -> MCU, type followed by one output_pair per output
+
+# type, analog inputs 1-3 (raw ADC), temperature (0.01 degrees), inputs bit mask, outputs bit mask
+sample_frame = struct.Struct("<BHHHhBB")
+# output index, value
+output_pair = struct.Struct("<BB")
+frame_crc = struct.Struct("<H")
+
+
+def frame(payload: bytes) -> bytes:
+    return FRAME_SYNC + bytes([len(payload)]) + payload + frame_crc.pack(binascii.crc_hqx(payload, 0xFFFF))
+
+
+class Histogram:
+    """Value counts per bucket, bucket n counts values up to bounds[n], the last one everything above."""
+    def __init__(self, bounds: list[float]):
+        self.bounds = bounds
+        self.counts: list[int] = [0] * (len(bounds) + 1)
+
+    def add(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+
+    def __str__(self):
+        labels = [f"<={bound * 1000:g}ms" for bound in self.bounds] + [f">{self.bounds[-1] * 1000:g}ms"]
+        return ", ".join(f"{label}: {count}" for label, count in zip(labels, self.counts) if count)
 
 
 class Arduino:
-    def __init__(self):
+    def __init__(self, device: str = "/dev/ttyUSB0", protocol: str = "ascii", baudrate: int = 9600,
+                 reset_delay: float = 2):
+        if protocol not in ["ascii", "binary"]:
+            raise ValueError(f"Arduino protocol: {protocol} is not valid")
+
+        self.device = device
+        self.protocol = protocol
+        self.baudrate = baudrate
+        self.reset_delay = reset_delay
         self.data: ArduinoData = ArduinoData()
         self.commands: queue.Queue = queue.Queue()
-        self.voltage1: list[float] = []
-        self.voltage2: list[float] = []
-        self.voltage3: list[float] = []
-        self.temperature: list[float] = []
+        self.pending: dict[int, tuple[bool, float, Future]] = {}
+        self.desired: dict[int, bool] = {}
+        self.command_latency: Histogram = Histogram([0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2])
+        self.filters: dict[str, Filter] = {
+            "battery_voltage": MovingAverage(3),
+            "aux12_voltage": MovingAverage(3),
+            "system_voltage": MovingAverage(3),
+            "temperature": MovingAverage(3),
+        }
         self.timestamp: float = time.time()
-        self.data_ready: threading.Event = threading.Event()
+        self.on_data: Optional[Callable[[], None]] = None
+        self.dropped_frames: int = 0
+        self.dropped_samples: int = 0
+        self.reconnects: int = 0
+        self.reconnect_time: Optional[float] = None
+        self.connected: threading.Event = threading.Event()
+        self._rx: bytearray = bytearray()
+        self._serial: Optional[serial.Serial] = None
+        self._writer: Optional[threading.Thread] = None
+        self._write_lock: threading.Lock = threading.Lock()
+        self._pending_lock: threading.Lock = threading.Lock()
+
+    def set_output(self, idx: int, value: bool) -> Future:
+        future = Future()
+        future.set_running_or_notify_cancel()  # only the MCU completes it, waiters can not cancel it
+        self.desired[idx] = bool(value)
+        self.commands.put((idx, bool(value), future))
+        return future
 
     def get_data(self) -> None:
-        with serial.Serial('/dev/ttyUSB0', 9600, timeout=1) as ser:
-            while True:
-                self.data_ready.clear()
-                # start_time = time.time()
-                self._handle_commands(ser)
-
-                ser.write(str.encode("s\n"))
-                line = ser.readline()   # read a '\n' terminated line
-                received = line.decode('utf-8').strip()
-                if received == "":
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._write_commands, daemon=True)
+            self._writer.start()
+
+        backoff = 0.5
+        lost_time = None
+        logged = False
+
+        while True:
+            try:
+                with serial.Serial(self.device, self.baudrate, timeout=1) as ser:
+                    # Opening the port pulls DTR low, which resets the Arduino.
+                    # Wait for the bootloader and drop whatever it printed.
+                    time.sleep(self.reset_delay)
+                    ser.reset_input_buffer()
+                    self._rx.clear()
+                    self._serial = ser
+
+                    if lost_time is not None:
+                        self.reconnects += 1
+                        self.reconnect_time = round(time.time() - lost_time, 1)
+                        logging.warning("Arduino reconnected on %s after %s s", self.device, self.reconnect_time)
+
+                        # The reset cleared all outputs, restore the last requested state
+                        for idx, value in self.desired.items():
+                            self.commands.put((idx, value, None))
+
+                    lost_time = None
+                    logged = False
+                    self.connected.set()
+                    backoff = 0.5
+
+                    try:
+                        while True:
+                            # start_time = time.time()
+
+                            if self.protocol == "binary":
+                                self._read_binary(ser)
+                            else:
+                                self._read_ascii(ser)
+                            # print(time.time() - start_time)
+                    finally:
+                        with self._write_lock:
+                            self.connected.clear()
+                            self._serial = None
+                        lost_time = time.time()
+
+            except (serial.SerialException, OSError) as e:
+                # Logged once per outage, the first failure to open counts as one too
+                if lost_time is None:
+                    lost_time = time.time()
+                if not logged:
+                    logged = True
+                    logging.error("Arduino connection on %s unavailable: %s", self.device, e)
+
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+    def _read_ascii(self, ser: serial.Serial) -> None:
+        self._write(str.encode("s\n"))
+        line = ser.readline()   # read a '\n' terminated line
+        # Garbage after a reset or hot-plug decodes to replacement characters and is dropped as malformed
+        received = line.decode('utf-8', errors='replace').strip()
+        if received == "":
+            return
+
+        # print(received)
+        received = received.split("|")
+
+        try:
+            self._sample(int(received[0]), int(received[1]), int(received[2]), float(received[3]),
+                         int(received[4]), int(received[5]))
+        except (ValueError, IndexError):
+            self.dropped_samples += 1
+            logging.debug("Dropped malformed Arduino sample: %s", received)
+
+    def _read_binary(self, ser: serial.Serial) -> None:
+        # The MCU streams samples unsolicited, when nothing arrives within
+        # the read timeout we fall back to asking for one.
+        chunk = ser.read(ser.in_waiting or 1)
+        if not chunk:
+            self._write(frame(bytes([FRAME_REQUEST])))
+            return
+
+        rx = self._rx
+        rx += chunk
+
+        while True:
+            start = rx.find(FRAME_SYNC)
+            if start < 0:
+                del rx[:-1]  # keep a possible first sync byte
+                return
+            del rx[:start]
+
+            if len(rx) < 3:
+                return
+
+            length = rx[2]
+            end = 3 + length + frame_crc.size
+            if len(rx) < end:
+                return
+
+            (crc,) = frame_crc.unpack_from(rx, 3 + length)
+            if binascii.crc_hqx(rx[3:3 + length], 0xFFFF) != crc:
+                self.dropped_frames += 1
+                del rx[:len(FRAME_SYNC)]
+                continue
+
+            if rx[3] == FRAME_SAMPLE and length == sample_frame.size:
+                _, ai1, ai2, ai3, temperature, inputs, outputs = sample_frame.unpack_from(rx, 3)
+                self._sample(ai1, ai2, ai3, temperature / 100, inputs, outputs)
+
+            del rx[:end]
+
+    def _sample(self, ai1: int, ai2: int, ai3: int, temperature: float, inputs: int, outputs: int) -> None:
+        # Factors is voltage before and after voltage divider
+        # R1 = 100k, R2 = 33k
+        # Vout = (Vs x R2) / (R1 + R2)
+        # Ratio = R2 / (R1 + R2)
+
+        ai_voltage = 4.096 / 1024
+        # ai_factor = [12.004 / 2.975, 12.004 / 2.979, 12.002 / 2.986]
+        ai_factor = [12.004 / 2.975, 12.004 / 2.979, 5.001 / 1.244]
+
+        filters = self.filters
+        self.data = ArduinoData(
+            battery_voltage=round(filters["battery_voltage"].update(ai1 * ai_voltage * ai_factor[0]), 2),
+            aux12_voltage=round(filters["aux12_voltage"].update(ai2 * ai_voltage * ai_factor[1]), 2),
+            system_voltage=round(filters["system_voltage"].update(ai3 * ai_voltage * ai_factor[2] + 0.03), 2),
+            temperature=round(filters["temperature"].update(temperature), 1),
+            inputs=tuple(not bool(inputs & (1 << n)) for n in range(5)),
+            outputs=tuple(bool(outputs & (1 << n)) for n in range(7))
+        )
+
+        self.timestamp = time.time()
+        self._confirm(outputs)
+
+        if self.on_data is not None:
+            self.on_data()
+
+    def _write(self, data: bytes) -> None:
+        # Blocks while disconnected
+        while True:
+            self.connected.wait()
+
+            with self._write_lock:
+                if self._serial is not None:
+                    self._serial.write(data)
+                    return
+
+    def _write_commands(self) -> None:
+        while True:
+            # Send right away, together with anything queued in the meantime
+            batch = [self.commands.get()]
+            self.connected.wait()
+            while not self.commands.empty():
+                batch.append(self.commands.get())
+
+            outputs = {}
+            sent_time = time.perf_counter()
+
+            with self._pending_lock:
+                for idx, value, future in batch:
+                    outputs[idx] = value
+
+                    # Replayed after a reconnect, whoever is waiting keeps waiting
+                    if future is None:
+                        continue
+
+                    # A newer command for the same output replaces one still waiting
+                    if idx in self.pending:
+                        self.pending[idx][2].set_exception(RuntimeError(f"Arduino output {idx} superseded"))
+                    self.pending[idx] = (value, sent_time, future)
+
+            try:
+                if self.protocol == "binary":
+                    pairs = b"".join(output_pair.pack(idx, int(value)) for idx, value in outputs.items())
+                    self._write(frame(bytes([FRAME_OUTPUT]) + pairs))
+                else:
+                    self._write("".join(f"o,{idx},{int(value)}\n" for idx, value in outputs.items()).encode())
+            except (serial.SerialException, OSError) as e:
+                # Replayed from desired once the reader has reconnected
+                logging.error("Unable to set Arduino outputs %s: %s", outputs, e)
+
+            for idx, value in outputs.items():
+                logging.info("Arduino output %d set to %s", idx, value)
+
+    def _confirm(self, outputs: int) -> None:
+        if not self.pending:
+            return
+
+        now = time.perf_counter()
+
+        with self._pending_lock:
+            for idx, (value, sent_time, future) in list(self.pending.items()):
+                if bool(outputs & (1 << (idx - 1))) != value:
                     continue
 
-                # print(received)
-                received = received.split("|")
-
-                # Factors is voltage before and after voltage divider
-                # R1 = 100k, R2 = 33k
-                # Vout = (Vs x R2) / (R1 + R2)
-                # Ratio = R2 / (R1 + R2)
-
-                ai_voltage = 4.096 / 1024
-                # ai_factor = [12.004 / 2.975, 12.004 / 2.979, 12.002 / 2.986]
-                ai_factor = [12.004 / 2.975, 12.004 / 2.979, 5.001 / 1.244]
-                ai_samples = 3
-
-                self.voltage1.append(int(received[0]) * ai_voltage * ai_factor[0])
-                self.voltage2.append(int(received[1]) * ai_voltage * ai_factor[1])
-                self.voltage3.append(int(received[2]) * ai_voltage * ai_factor[2] + 0.03)
-                self.temperature.append(float(received[3]))
-
-                if len(self.voltage1) > ai_samples:
-                    self.voltage1.pop(0)
-                if len(self.voltage2) > ai_samples:
-                    self.voltage2.pop(0)
-                if len(self.voltage3) > ai_samples:
-                    self.voltage3.pop(0)
-                if len(self.temperature) > ai_samples:
-                    self.temperature.pop(0)
-
-                self.data.battery_voltage = round(statistics.mean(self.voltage1), 2)
-                self.data.aux12_voltage = round(statistics.mean(self.voltage2), 2)
-                self.data.system_voltage = round(statistics.mean(self.voltage3), 2)
-                self.data.temperature = round(statistics.mean(self.temperature), 1)
-                self.data.inputs = [not bool(int(received[4]) & (1 << n)) for n in range(5)]
-                self.data.outputs = [bool(int(received[5]) & (1 << n)) for n in range(7)]
-
-                self.timestamp = time.time()
-                self.data_ready.set()
-                # print(time.time() - start_time)
-
-    def _handle_commands(self, ser: serial.Serial) -> None:
-        while not self.commands.empty():
-            idx, value = self.commands.get()
-            value_int = int(value is True)
-
-            ser.write(str.encode(f"o,{idx},{value_int}\n"))
-            logging.info("Arduino output %d set to %s", idx, value)
-            self.commands.task_done()
+                del self.pending[idx]
+                self.command_latency.add(now - sent_time)
+                future.set_result(now - sent_time)
@@ -0,0 +1,143 @@
+import argparse
+import os
+import select
+import statistics
+import threading
+import time
+import tty
+from collections import deque
+
+from arduino import (Arduino, frame, frame_crc, sample_frame, output_pair,
+                     FRAME_SYNC, FRAME_SAMPLE, FRAME_REQUEST, FRAME_OUTPUT)
+
+'''
+Arduino simulator on a pseudo terminal.
+
+Answers "s" polls and "o,idx,value" commands in ascii mode, streams sample frames
+(and answers request frames) in binary mode. Point alarm.py at the printed device
+with [arduino] device, or use --bench to measure the host side of the link.
+'''
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--protocol', dest='protocol', action='store', choices=["ascii", "binary"], default="ascii",
+                    help="serial protocol to simulate")
+parser.add_argument('--rate', dest='rate', action='store', type=float, default=100,
+                    help="samples per second streamed in binary mode, 0 for request/response only")
+parser.add_argument('--bench', dest='bench', action='store', type=float, default=0,
+                    help="run an Arduino reader against the simulator for this many seconds")
+
+
+class Simulator:
+    def __init__(self, protocol: str, rate: float):
+        self.protocol = protocol
+        self.rate = rate
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.device = os.ttyname(self.slave)
+        self.inputs = 0b11111  # inputs are active low
+        self.outputs = 0
+        self.sent: deque[float] = deque()
+
+    def run(self) -> None:
+        rx = bytearray()
+        interval = 1 / self.rate if self.protocol == "binary" and self.rate else None
+        next_sample = time.monotonic()
+
+        while True:
+            timeout = max(0.0, next_sample - time.monotonic()) if interval else None
+            readable, _, _ = select.select([self.master], [], [], timeout)
+
+            if readable:
+                rx += os.read(self.master, 1024)
+                self._handle(rx)
+
+            if interval and time.monotonic() >= next_sample:
+                self._send_sample()
+                next_sample += interval
+
+    def _handle(self, rx: bytearray) -> None:
+        if self.protocol == "ascii":
+            while b"\n" in rx:
+                line, _, rest = rx.partition(b"\n")
+                rx[:] = rest
+                fields = line.decode().split(",")
+
+                if fields[0] == "s":
+                    self._send_sample()
+                elif fields[0] == "o":
+                    self._set_output(int(fields[1]), int(fields[2]))
+            return
+
+        while (start := rx.find(FRAME_SYNC)) >= 0 and len(rx) >= start + 3:
+            del rx[:start]
+            end = 3 + rx[2] + frame_crc.size
+            if len(rx) < end:
+                return
+
+            if rx[3] == FRAME_REQUEST:
+                self._send_sample()
+            elif rx[3] == FRAME_OUTPUT:
+                for idx, value in output_pair.iter_unpack(rx[4:3 + rx[2]]):
+                    self._set_output(idx, value)
+
+            del rx[:end]
+
+    def _set_output(self, idx: int, value: int) -> None:
+        # Outputs are changed starting at 1, see arduino.py
+        if value:
+            self.outputs |= 1 << (idx - 1)
+        else:
+            self.outputs &= ~(1 << (idx - 1))
+
+    def _send_sample(self) -> None:
+        ai = [780, 770, 310]  # about 12.6 V, 12.5 V and 5 V after the dividers
+        temperature = 2150
+
+        if self.protocol == "binary":
+            payload = sample_frame.pack(FRAME_SAMPLE, *ai, temperature, self.inputs, self.outputs)
+            message = frame(payload)
+        else:
+            message = f"{ai[0]}|{ai[1]}|{ai[2]}|{temperature / 100}|{self.inputs}|{self.outputs}\n".encode()
+
+        self.sent.append(time.perf_counter())
+        os.write(self.master, message)
+
+
+def bench(simulator: Simulator, seconds: float) -> None:
+    arduino = Arduino(simulator.device, simulator.protocol)
+    latency: list[float] = []
+
+    def received() -> None:
+        received_time = time.perf_counter()
+        if simulator.sent:
+            latency.append(received_time - simulator.sent.popleft())
+
+    arduino.on_data = received
+    threading.Thread(target=arduino.get_data, daemon=True).start()
+
+    # Opening the port flushes its input, start streaming once the reader is up
+    time.sleep(0.5)
+    threading.Thread(target=simulator.run, daemon=True).start()
+
+    time.sleep(seconds)
+    samples = len(latency)
+
+    if not samples:
+        print("No samples received")
+        return
+
+    latency.sort()
+    print(f"Protocol: {simulator.protocol}, samples: {samples}, {samples / seconds:.1f} samples/s")
+    print(f"Latency mean: {statistics.mean(latency) * 1000:.3f} ms, "
+          f"p99: {latency[int(samples * 0.99) - 1] * 1000:.3f} ms, dropped frames: {arduino.dropped_frames}")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    sim = Simulator(args.protocol, args.rate)
+    print(f"Simulating Arduino ({args.protocol}) on {sim.device}")
+
+    if args.bench:
+        bench(sim, args.bench)
+    else:
+        sim.run()
@@ -0,0 +1,31 @@
+import os
+
+
+def atomic_write(path: str, data: bytes) -> None:
+    """
+    Replace path with data so a crash or power cut leaves either the old or the new file.
+
+    The data goes to a temporary file next to path, which is fsynced and renamed over it,
+    then the directory is fsynced so the rename itself is on disk. On failure the temporary
+    file is removed and the OSError raised to the caller.
+    """
+    temp_path = f"{path}.tmp"
+
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except OSError:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+    fd = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
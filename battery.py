@@ -1,9 +1,13 @@
-from scipy.interpolate import interp1d
+import bisect
+from array import array
+from typing import Callable, Optional
 
+from filters import MovingAverage
 
-class Battery:
+# Resting voltage per state of charge (percentage: voltage) for 12 V batteries
+chemistries = {
     # Source: https://www.rebel-cell.com/knowledge-base/battery-capacity/
-    capacity_voltage = {
+    "agm": {
         100: 12.7,
         90: 12.5,
         80: 12.42,
@@ -15,20 +19,102 @@ class Battery:
         20: 11.58,
         10: 11.31,
         0: 10.5
+    },
+    "lifepo4": {
+        100: 13.6,
+        90: 13.32,
+        80: 13.28,
+        70: 13.24,
+        60: 13.2,
+        50: 13.16,
+        40: 13.12,
+        30: 13.08,
+        20: 13.0,
+        10: 12.8,
+        0: 10.0
     }
+}
+
+
+def _solve(matrix: list[list[float]], values: list[float]) -> list[float]:
+    # Gaussian elimination with partial pivoting, the systems here are a dozen rows at most
+    n = len(values)
+    rows = [row[:] + [value] for row, value in zip(matrix, values)]
+
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(rows[r][col]))
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+
+        for r in range(col + 1, n):
+            factor = rows[r][col] / rows[col][col]
+            for c in range(col, n + 1):
+                rows[r][c] -= factor * rows[col][c]
+
+    result = [0.0] * n
+    for r in reversed(range(n)):
+        result[r] = (rows[r][n] - sum(rows[r][c] * result[c] for c in range(r + 1, n))) / rows[r][r]
+
+    return result
+
+
+def cubic_spline(points: dict[float, float]) -> Callable[[float], float]:
+    """Not-a-knot cubic spline through the points, same curve as scipy interp1d(kind='cubic')."""
+    xs = sorted(points)
+    ys = [points[x] for x in xs]
+    n = len(xs)
+
+    if n < 4:
+        raise ValueError("Cubic spline needs at least 4 points")
+
+    h = [xs[i + 1] - xs[i] for i in range(n - 1)]
+    matrix = [[0.0] * n for _ in range(n)]
+    values = [0.0] * n
+
+    # Second derivatives, continuous third derivative at the second and second to last point
+    matrix[0][0:3] = [h[1], -(h[0] + h[1]), h[0]]
+    matrix[n - 1][n - 3:n] = [h[n - 2], -(h[n - 3] + h[n - 2]), h[n - 3]]
+
+    for i in range(1, n - 1):
+        matrix[i][i - 1:i + 2] = [h[i - 1], 2 * (h[i - 1] + h[i]), h[i]]
+        values[i] = 6 * ((ys[i + 1] - ys[i]) / h[i] - (ys[i] - ys[i - 1]) / h[i - 1])
+
+    m = _solve(matrix, values)
+
+    def spline(x: float) -> float:
+        i = min(max(bisect.bisect_right(xs, x) - 1, 0), n - 2)
+        a, b = xs[i + 1] - x, x - xs[i]
+        return (m[i] * a ** 3 / (6 * h[i]) + m[i + 1] * b ** 3 / (6 * h[i]) +
+                (ys[i] / h[i] - m[i] * h[i] / 6) * a + (ys[i + 1] / h[i] - m[i + 1] * h[i] / 6) * b)
+
+    return spline
+
+
+class Battery:
+    def __init__(self, chemistry: str = "agm", curve: dict[int, float] = None, smoothing: int = 30):
+        if curve is None and chemistry not in chemistries:
+            raise ValueError(f"Battery chemistry: {chemistry} is not valid")
+
+        interpolate_levels = cubic_spline(curve or chemistries[chemistry])
+        self.percentage: MovingAverage = MovingAverage(smoothing)
+        self.battery_levels = {k: round(interpolate_levels(k), 3) for k in range(101)}
+
+        # Percentage per millivolt from the 0 % voltage up, the highest level the voltage reaches
+        level_mv = {k: round(v * 1000) for k, v in self.battery_levels.items()}
+        self.min_mv = min(level_mv.values())
+        self.levels_mv: array = array('b', [-1] * (max(level_mv.values()) - self.min_mv + 1))
 
-    interpolate_levels = interp1d(list(capacity_voltage.keys()), list(capacity_voltage.values()), 'cubic')
+        for percentage, mv in level_mv.items():
+            idx = mv - self.min_mv
+            self.levels_mv[idx] = max(self.levels_mv[idx], percentage)
 
-    def __init__(self):
-        self.percentage = []
-        self.battery_levels = {k: round(float(self.interpolate_levels(k)), 3) for k in range(101)}
+        for idx in range(1, len(self.levels_mv)):
+            self.levels_mv[idx] = max(self.levels_mv[idx], self.levels_mv[idx - 1])
 
-    def level(self, input_voltage: float) -> int:
-        for percentage, voltage in reversed(self.battery_levels.items()):
-            if input_voltage >= voltage:
-                self.percentage.append(percentage)
+    def level(self, input_voltage: float) -> Optional[int]:
+        idx = int(input_voltage * 1000 + 1e-6) - self.min_mv
 
-                if len(self.percentage) > 30:
-                    self.percentage.pop(0)
+        if idx < 0:
+            return None
 
-                return int(round(sum(self.percentage) / len(self.percentage), 0))
+        percentage = self.levels_mv[min(idx, len(self.levels_mv) - 1)]
+        return int(round(self.percentage.update(percentage), 0))
@@ -0,0 +1,183 @@
+import json
+import logging
+import os
+import struct
+import time
+from typing import Optional
+
+from atomic import atomic_write
+
+# timestamp (s), battery voltage (mV), level (%), temperature (0.1 degrees), flags
+sample_record = struct.Struct("<IHBhB")
+FLAG_CHARGING = 0x01
+FLAG_TEST = 0x02
+
+
+class DischargeFit:
+    """Least squares line through (time, level) samples, kept as running sums."""
+    def __init__(self):
+        self.n: int = 0
+        self.t0: Optional[float] = None
+        self.sum_t: float = 0.0
+        self.sum_level: float = 0.0
+        self.sum_tt: float = 0.0
+        self.sum_t_level: float = 0.0
+
+    def add(self, timestamp: float, level: float) -> None:
+        if self.t0 is None:
+            self.t0 = timestamp
+
+        t = timestamp - self.t0  # relative time keeps the sums small
+        self.n += 1
+        self.sum_t += t
+        self.sum_level += level
+        self.sum_tt += t * t
+        self.sum_t_level += t * level
+
+    @property
+    def slope(self) -> Optional[float]:
+        # Percent per second, negative while discharging
+        denominator = self.n * self.sum_tt - self.sum_t ** 2
+
+        if self.n < 2 or denominator <= 0:
+            return None
+
+        return (self.n * self.sum_t_level - self.sum_t * self.sum_level) / denominator
+
+
+class BatteryAnalytics:
+    """
+    Battery samples appended to a fixed size record file, and a discharge model.
+
+    During a battery test the level is fitted against time, the resulting discharge rate
+    (percent per hour) is appended to the test log. Remaining runtime is estimated from the
+    running test or the latest result, capacity is the latest rate compared to the first test.
+    Only the first and last test are kept in memory. Once the sample file grows past max_bytes
+    the newest half is copied to a temporary file and renamed over it, a rolling window that
+    never reads more than that half back.
+    """
+    def __init__(self, samples_path: str = "logs/battery_samples.bin", tests_path: str = "logs/battery_tests.jsonl",
+                 interval: float = 60, max_bytes: int = 1024 * 1024):
+        self.samples_path = samples_path
+        self.tests_path = tests_path
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.test: Optional[DischargeFit] = None
+        self.test_start: Optional[tuple[float, int]] = None
+        self.reference_rate: Optional[float] = None
+        self.latest_rate: Optional[float] = None
+        self._last_record: float = 0.0
+
+        try:
+            self._size: int = os.path.getsize(samples_path)
+
+            # A record torn by a power cut would shift every record appended after it
+            if self._size % sample_record.size:
+                self._size -= self._size % sample_record.size
+                os.truncate(samples_path, self._size)
+        except OSError:
+            self._size = 0
+
+        try:
+            with open(tests_path) as f:
+                for line in f:
+                    rate = json.loads(line)["rate"]
+                    self.reference_rate = self.reference_rate or rate
+                    self.latest_rate = rate
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError) as e:
+            logging.error("Unable to read battery tests from %s: %s", tests_path, e)
+
+    def record(self, voltage: float, level: Optional[int], temperature: float, charging: bool) -> None:
+        now = time.time()
+
+        if self.test is not None and level is not None:
+            self.test.add(now, level)  # the fit takes every sample, the file at most one per interval
+
+        if now - self._last_record < self.interval:
+            return
+
+        self._last_record = now
+        flags = (FLAG_CHARGING if charging else 0) | (FLAG_TEST if self.test is not None else 0)
+        record = sample_record.pack(int(now), round(voltage * 1000), level if level is not None else 255,
+                                    round(temperature * 10), flags)
+
+        try:
+            with open(self.samples_path, "ab") as f:
+                f.write(record)
+        except OSError as e:
+            logging.error("Unable to write battery sample: %s", e)
+            return
+
+        self._size += len(record)
+
+        if self._size > self.max_bytes:
+            self._compact()
+
+    def _compact(self) -> None:
+        try:
+            with open(self.samples_path, "rb") as f:
+                keep = self.max_bytes // 2 // sample_record.size * sample_record.size
+                f.seek(max(self._size - keep, 0))
+                tail = f.read(keep)
+
+            atomic_write(self.samples_path, tail)
+        except OSError as e:
+            logging.error("Unable to compact battery samples: %s", e)
+            return
+
+        self._size = len(tail)
+
+    def start_test(self, level: int) -> None:
+        self.test = DischargeFit()
+        self.test_start = (time.time(), level)
+        self.test.add(*self.test_start)
+
+    def cancel_test(self) -> None:
+        self.test = None
+        self.test_start = None
+
+    def finish_test(self, level: int) -> Optional[dict]:
+        slope = self.test.slope if self.test is not None else None
+        start_time, start_level = self.test_start or (time.time(), level)
+        self.cancel_test()
+
+        if slope is None or slope >= 0:
+            logging.error("Battery test gave no discharge rate")
+            return None
+
+        result = {
+            "timestamp": int(start_time),
+            "seconds": int(time.time() - start_time),
+            "start_level": start_level,
+            "end_level": level,
+            "rate": round(-slope * 3600, 3)
+        }
+
+        try:
+            with open(self.tests_path, "a") as f:
+                f.write(json.dumps(result) + "\n")
+        except OSError as e:
+            logging.error("Unable to write battery test result: %s", e)
+
+        self.reference_rate = self.reference_rate or result["rate"]
+        self.latest_rate = result["rate"]
+        return result
+
+    def runtime(self, level: Optional[int]) -> Optional[float]:
+        # Hours until empty at the measured discharge rate
+        slope = self.test.slope if self.test is not None else None
+        rate = -slope * 3600 if slope is not None and slope < 0 else self.latest_rate
+
+        if level is None or not rate:
+            return None
+
+        return round(level / rate, 1)
+
+    def capacity(self) -> Optional[float]:
+        # Percent of the capacity measured in the first test
+        if not self.reference_rate or not self.latest_rate:
+            return None
+
+        return round(self.reference_rate / self.latest_rate * 100, 1)
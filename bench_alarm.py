@@ -0,0 +1,109 @@
+import argparse
+import atexit
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from types import ModuleType, SimpleNamespace
+
+'''
+Benchmarks for alarm.py message handling, runs off the Pi.
+
+alarm.py is imported in a scratch directory with a copy of config.ini (or the sample
+config), so the state and settings files of a live installation are never touched.
+Without RPi.GPIO, FakeGPIO from gpio_inputs stands in for it.
+
+--dispatch: handles zigbee2mqtt messages for the configured sensors while the topic
+index holds 20 to 2000 sensors, the cost per message should stay flat.
+
+--check-zone: check_zone throughput in disarmed and armed_home, for every zone that
+does not start a flow in that state (starting one would change what is measured).
+'''
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--dispatch', dest='dispatch', action='store_true',
+                    help="per message cost of on_message dispatch against the number of sensors")
+parser.add_argument('--check-zone', dest='check_zone', action='store_true',
+                    help="check_zone calls per second")
+parser.add_argument('--messages', dest='messages', action='store', type=int, default=20000,
+                    help="messages handled per measurement")
+
+
+def import_alarm():
+    config = "config.ini" if os.path.exists("config.ini") else "samples/config_sample.ini"
+    workdir = tempfile.mkdtemp(prefix="alarm_bench_")
+    shutil.copy(config, os.path.join(workdir, "config.ini"))
+    os.makedirs(os.path.join(workdir, "logs"))
+    os.chdir(workdir)
+    atexit.register(shutil.rmtree, workdir, True)  # runs after the exit handlers of alarm.py
+
+    try:
+        import RPi.GPIO  # noqa: F401
+    except ImportError:
+        from gpio_inputs import FakeGPIO
+        rpi = ModuleType("RPi")
+        rpi.GPIO = FakeGPIO()
+        sys.modules["RPi"] = rpi
+        sys.modules["RPi.GPIO"] = rpi.GPIO
+
+    sys.argv = ["alarm.py", "--silent", "--log", "WARNING"]
+    import alarm
+    return alarm
+
+
+def sensor_message(alarm, sensor) -> SimpleNamespace:
+    # Inactive value, so the state does not change while measuring
+    inactive = {True: False, False: True}.get(sensor.value.value, "off")
+    payload = json.dumps({sensor.field: inactive, "battery": 90, "linkquality": 120}).encode()
+    return SimpleNamespace(topic=sensor.topic, payload=payload, retain=0)
+
+
+def dispatch(alarm, messages: int) -> None:
+    configured = list(alarm.sensors.values())
+    sample = [sensor_message(alarm, sensor) for sensor in configured]
+
+    for count in [20, 200, 2000]:
+        # Extra sensors only fill the index, messages go to the configured ones
+        extra = {f"bench{n}": SimpleNamespace(topic=f"zigbee2mqtt/Bench sensor {n}")
+                 for n in range(max(0, count - len(configured)))}
+        alarm.sensors = {s.key: s for s in configured} | extra
+        alarm.topic_handlers = alarm.build_topic_handlers()
+
+        timings = []
+        for n in range(messages):
+            msg = sample[n % len(sample)]
+            start_time = time.perf_counter()
+            alarm.handle_message(msg)
+            timings.append(time.perf_counter() - start_time)
+
+        timings.sort()
+        print(f"Sensors: {len(alarm.sensors):5d}, topics: {len(alarm.topic_handlers):5d}, "
+              f"median {statistics.median(timings) * 1e6:.2f} us, p99 {timings[int(len(timings) * 0.99)] * 1e6:.2f} us")
+
+
+def check_zone(alarm, calls: int) -> None:
+    for system, starts_flow in [("disarmed", lambda r: r.fire or r.direct or r.water),
+                                ("armed_home", lambda r: r.fire or r.direct or r.water or r.home)]:
+        alarm.state.system = system
+        zones = [zone for zone in alarm.zones.values() if not starts_flow(zone.route)]
+
+        start_time = time.perf_counter()
+        for n in range(calls):
+            alarm.check_zone(zones[n % len(zones)])
+        elapsed = time.perf_counter() - start_time
+
+        print(f"State: {system:10s} zones: {len(zones):3d}, {calls / elapsed:,.0f} calls/s, "
+              f"{elapsed / calls * 1e6:.3f} us per call")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    alarm = import_alarm()
+
+    if args.dispatch:
+        dispatch(alarm, args.messages)
+    if args.check_zone:
+        check_zone(alarm, args.messages * 10)
@@ -0,0 +1,85 @@
+import argparse
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+from battery import Battery
+
+'''
+Battery model benchmark: cost per sample and process startup, before and after.
+
+"Before" is the previous level(): a walk over the 101 percentages from the top until the
+voltage reaches one (same curve and same 30 sample average), and a startup that imports
+SciPy to build the curve with interp1d. The SciPy run is skipped when it is not installed.
+'''
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--samples', dest='samples', action='store', type=int, default=200000,
+                    help="voltages converted per measurement")
+parser.add_argument('--runs', dest='runs', action='store', type=int, default=10,
+                    help="interpreter starts per startup measurement")
+
+scipy_startup = """
+from scipy.interpolate import interp1d
+capacity_voltage = {100: 12.7, 90: 12.5, 80: 12.42, 70: 12.32, 60: 12.2, 50: 12.06,
+                    40: 11.9, 30: 11.75, 20: 11.58, 10: 11.31, 0: 10.5}
+f = interp1d(list(capacity_voltage.keys()), list(capacity_voltage.values()), 'cubic')
+{k: round(float(f(k)), 3) for k in range(101)}
+"""
+
+
+class LinearBattery:
+    def __init__(self, battery_levels: dict[int, float]):
+        self.percentage = []
+        self.battery_levels = battery_levels
+
+    def level(self, input_voltage: float) -> int:
+        for percentage, voltage in reversed(self.battery_levels.items()):
+            if input_voltage >= voltage:
+                self.percentage.append(percentage)
+
+                if len(self.percentage) > 30:
+                    self.percentage.pop(0)
+
+                return int(round(sum(self.percentage) / len(self.percentage), 0))
+
+
+def per_sample(samples: int) -> None:
+    voltages = [random.uniform(10.5, 13.0) for _ in range(samples)]
+    battery = Battery()
+
+    for name, model in [("before (linear walk)", LinearBattery(battery.battery_levels)), ("after (mV table)", battery)]:
+        start_time = time.perf_counter()
+        for voltage in voltages:
+            model.level(voltage)
+        elapsed = time.perf_counter() - start_time
+        print(f"Per sample {name}: {elapsed / samples * 1e6:.3f} us")
+
+
+def startup(code: str, runs: int) -> float:
+    timings = []
+
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start_time)
+
+    return statistics.median(timings)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    per_sample(args.samples)
+
+    baseline = startup("pass", args.runs)
+    print(f"Interpreter startup: {baseline * 1000:.1f} ms")
+
+    try:
+        print(f"Startup before (SciPy interp1d): +{(startup(scipy_startup, args.runs) - baseline) * 1000:.1f} ms")
+    except subprocess.CalledProcessError:
+        print("Startup before (SciPy interp1d): skipped, SciPy not installed")
+
+    print(f"Startup after (battery.Battery): "
+          f"+{(startup('import battery; battery.Battery()', args.runs) - baseline) * 1000:.1f} ms")
@@ -0,0 +1,81 @@
+import argparse
+import statistics
+import threading
+import time
+from types import SimpleNamespace
+
+from gpio_inputs import FakeGPIO, InputEngine
+
+'''
+Input engine benchmark on FakeGPIO, runs on any Linux box.
+
+Measures the cost of handling an edge and the time from a pin change to on_change
+and to on_active (after the debounce time), using the same threading timers as alarm.py
+does without an event loop. The old polling loop woke up every 10 ms whatever happened
+and needed at least 50 ms of consecutive reads before a zone was active.
+'''
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--inputs', dest='inputs', action='store', type=int, default=16,
+                    help="number of inputs added to the engine")
+parser.add_argument('--edges', dest='edges', action='store', type=int, default=100000,
+                    help="edges handled in the throughput run")
+parser.add_argument('--debounce', dest='debounce', action='store', type=float, default=0.02,
+                    help="debounce time (seconds) in the latency run")
+parser.add_argument('--samples', dest='samples', action='store', type=int, default=200,
+                    help="activations measured in the latency run")
+
+
+class NoTimer:
+    def cancel(self) -> None:
+        pass
+
+
+def throughput(inputs: int, edges: int) -> None:
+    gpio = FakeGPIO()
+    engine = InputEngine(gpio, schedule=lambda seconds, callback: NoTimer())
+
+    for n in range(inputs):
+        engine.add(SimpleNamespace(key=f"zone{n:02}", gpio=n, debounce=0.05))
+    engine.start(lambda i, value: None, lambda i: None)
+
+    start_time = time.perf_counter()
+    for n in range(edges):
+        gpio.set_input(n % inputs, not gpio.levels[n % inputs])
+    elapsed = time.perf_counter() - start_time
+
+    print(f"Inputs: {inputs}, edges: {edges}, {elapsed / edges * 1e6:.2f} us per edge")
+
+
+def latency(debounce: float, samples: int) -> None:
+    gpio = FakeGPIO()
+    engine = InputEngine(gpio)
+    changed, active = threading.Event(), threading.Event()
+    change_latency, active_latency = [], []
+
+    engine.add(SimpleNamespace(key="zone01", gpio=5, debounce=debounce))
+    engine.start(lambda i, value: changed.set(), lambda i: active.set())
+
+    for _ in range(samples):
+        changed.clear()
+        active.clear()
+
+        start_time = time.perf_counter()
+        gpio.set_input(5, True)
+        changed.wait()
+        change_latency.append(time.perf_counter() - start_time)
+        active.wait()
+        active_latency.append(time.perf_counter() - start_time - debounce)
+
+        gpio.set_input(5, False)
+
+    for name, values in [("on_change", change_latency), ("on_active - debounce", active_latency)]:
+        values.sort()
+        print(f"{name}: mean {statistics.mean(values) * 1000:.3f} ms, "
+              f"p99 {values[int(len(values) * 0.99) - 1] * 1000:.3f} ms")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    throughput(args.inputs, args.edges)
+    latency(args.debounce, args.samples)
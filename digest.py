@@ -0,0 +1,78 @@
+import asyncio
+import logging
+from typing import Callable, Optional
+
+
+class Category:
+    __slots__ = ("window", "latest", "handle", "pending", "priority", "last_sent")
+
+    def __init__(self, window: float, latest: bool = False):
+        self.window = window
+        self.latest = latest
+        self.handle: Optional[asyncio.TimerHandle] = None
+        self.pending: dict[str, list[str]] = {}
+        self.priority: int = 0
+        self.last_sent: Optional[tuple[str, str]] = None
+
+
+class Digest:
+    """
+    Coalesces notifications per category.
+
+    The first notification of a quiet category is sent right away and opens a window,
+    notifications arriving within the window are merged into one digest sent when it
+    closes (the window stays open as long as digests keep being sent). A "latest" category
+    reports a state (e.g. the list of failed checks), only the last message in the window
+    is sent, and not at all if it equals the previous one. Emergency priority is never held back.
+    """
+    def __init__(self, push: Callable[..., None], call_later: Callable[..., asyncio.TimerHandle],
+                 categories: dict[str, Category]):
+        self.push = push
+        self.call_later = call_later
+        self.categories = categories
+        self.merged: int = 0
+
+    def notify(self, category: str, title: str, message: str, priority: int = 0) -> None:
+        c = self.categories[category]
+
+        if priority >= 2 or c.window <= 0:
+            self.push(title, message, priority)
+            return
+
+        if c.handle is None:
+            self._send(c, title, message, priority)
+            c.handle = self.call_later(c.window, self._flush, c)
+            return
+
+        if c.latest:
+            c.pending.clear()
+
+        items = c.pending.setdefault(title, [])
+        if message not in items:
+            items.append(message)
+        c.priority = max(c.priority, priority)
+        self.merged += 1
+
+    def _send(self, c: Category, title: str, message: str, priority: int) -> None:
+        if c.latest and c.last_sent == (title, message):
+            logging.debug("Notification unchanged, not sent: %s", title)
+            return
+
+        c.last_sent = (title, message)
+        self.push(title, message, priority)
+
+    def _flush(self, c: Category) -> None:
+        c.handle = None
+
+        if not c.pending:
+            return
+
+        for title, items in c.pending.items():
+            if len(items) > 1:
+                self._send(c, f"{title} ({len(items)})", ", ".join(items), c.priority)
+            else:
+                self._send(c, title, items[0], c.priority)
+
+        c.pending = {}
+        c.priority = 0
+        c.handle = self.call_later(c.window, self._flush, c)
@@ -0,0 +1,137 @@
+import bisect
+from array import array
+from typing import Optional
+
+
+class RingBuffer:
+    """Fixed size window of floats, the oldest value is overwritten once full."""
+    def __init__(self, size: int):
+        if size < 1:
+            raise ValueError(f"Ring buffer size: {size} is not valid")
+
+        self.size = size
+        self.values: array = array('d', [0.0] * size)
+        self.count: int = 0
+        self.head: int = 0
+
+    def append(self, value: float) -> Optional[float]:
+        # Returns the value that was pushed out, if any
+        evicted = self.values[self.head] if self.count == self.size else None
+
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+        return evicted
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self):
+        start = self.head - self.count
+        for n in range(self.count):
+            yield self.values[(start + n) % self.size]
+
+
+class Filter:
+    def update(self, value: float) -> float:
+        raise NotImplementedError
+
+    @property
+    def value(self) -> Optional[float]:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+
+class MovingAverage(Filter):
+    def __init__(self, size: int):
+        self.window: RingBuffer = RingBuffer(size)
+        self.total: float = 0.0
+
+    def update(self, value: float) -> float:
+        evicted = self.window.append(value)
+        self.total += value - (evicted or 0.0)
+
+        # Start from a fresh sum every lap so float rounding does not add up
+        if self.window.head == 0:
+            self.total = sum(self.window.values)
+
+        return self.value
+
+    @property
+    def value(self) -> Optional[float]:
+        return self.total / len(self.window) if len(self.window) else None
+
+    def __len__(self) -> int:
+        return len(self.window)
+
+
+class ExponentialAverage(Filter):
+    def __init__(self, alpha: float):
+        if not 0 < alpha <= 1:
+            raise ValueError(f"Exponential average alpha: {alpha} is not valid")
+
+        self.alpha = alpha
+        self.count: int = 0
+        self._value: Optional[float] = None
+
+    def update(self, value: float) -> float:
+        if self._value is None:
+            self._value = value
+        else:
+            self._value += self.alpha * (value - self._value)
+
+        self.count += 1
+        return self._value
+
+    @property
+    def value(self) -> Optional[float]:
+        return self._value
+
+    def __len__(self) -> int:
+        return self.count
+
+
+class MovingMedian(Filter):
+    def __init__(self, size: int):
+        self.window: RingBuffer = RingBuffer(size)
+        self.ordered: list[float] = []
+
+    def update(self, value: float) -> float:
+        evicted = self.window.append(value)
+
+        if evicted is not None:
+            del self.ordered[bisect.bisect_left(self.ordered, evicted)]
+        bisect.insort(self.ordered, value)
+
+        return self.value
+
+    @property
+    def value(self) -> Optional[float]:
+        count = len(self.ordered)
+        if not count:
+            return None
+
+        middle = count // 2
+        if count % 2:
+            return self.ordered[middle]
+        return (self.ordered[middle - 1] + self.ordered[middle]) / 2
+
+    def __len__(self) -> int:
+        return len(self.window)
+
+
+def create_filter(spec: str) -> Filter:
+    # "mean:3", "ema:0.3" or "median:10"
+    kind, _, parameter = spec.partition(":")
+
+    if kind == "mean":
+        return MovingAverage(int(parameter))
+    if kind == "ema":
+        return ExponentialAverage(float(parameter))
+    if kind == "median":
+        return MovingMedian(int(parameter))
+
+    raise ValueError(f"Filter: {spec} is not valid")
@@ -0,0 +1,207 @@
+import logging
+import mmap
+import struct
+import threading
+from typing import Callable, Optional
+
+
+class FakeGPIO:
+    """In-memory stand-in for RPi.GPIO, drives the input engine without a Pi."""
+    BCM = 11
+    IN = 1
+    OUT = 0
+    BOTH = 33
+
+    def __init__(self):
+        self.levels: dict[int, int] = {}
+        self.callbacks: dict[int, Callable[[int], None]] = {}
+
+    def setmode(self, mode: int) -> None:
+        pass
+
+    def setwarnings(self, flag: bool) -> None:
+        pass
+
+    def setup(self, gpio: int, direction: int) -> None:
+        self.levels.setdefault(gpio, 0)
+
+    def input(self, gpio: int) -> int:
+        return self.levels.get(gpio, 0)
+
+    def output(self, gpio: int, value) -> None:
+        self.levels[gpio] = int(bool(value))
+
+    def add_event_detect(self, gpio: int, edge: int, callback: Callable[[int], None] = None,
+                         bouncetime: int = None) -> None:
+        self.callbacks[gpio] = callback
+
+    def remove_event_detect(self, gpio: int) -> None:
+        self.callbacks.pop(gpio, None)
+
+    def set_input(self, gpio: int, value: bool) -> None:
+        changed = self.levels.get(gpio, 0) != int(value)
+        self.levels[gpio] = int(value)
+
+        if changed and gpio in self.callbacks:
+            self.callbacks[gpio](gpio)
+
+
+class GpioLevels:
+    """
+    Snapshot of all pin levels as a bit mask, bit n is GPIO n.
+
+    Reads the GPLEV0 register once through /dev/gpiomem on the SoCs known to have it
+    there (BCM2835 to BCM2711, Pi 1 to 4), and falls back to one read per pin everywhere
+    else: a Pi 5 (RP1) maps something else at that offset, not a Pi or FakeGPIO has none.
+    """
+    GPLEV0 = 0x34
+    SOCS = ("brcm,bcm2835", "brcm,bcm2836", "brcm,bcm2837", "brcm,bcm2711")
+
+    def __init__(self, gpio, pins, device: str = "/dev/gpiomem",
+                 compatible: str = "/proc/device-tree/compatible"):
+        self.gpio = gpio
+        self.pins: list[int] = sorted(set(pins))
+        self._register: Optional[mmap.mmap] = None
+
+        try:
+            with open(compatible, "rb") as f:
+                socs = f.read().decode(errors="replace").split("\0")
+        except OSError:
+            socs = []
+
+        if not any(soc in self.SOCS for soc in socs):
+            logging.info("GPLEV0 register not supported on %s, reading pins one by one",
+                         ", ".join(filter(None, socs)) or "this board")
+            return
+
+        try:
+            with open(device, "r+b") as f:
+                self._register = mmap.mmap(f.fileno(), 4096)
+        except OSError as e:
+            logging.warning("Unable to map %s, reading pins one by one: %s", device, e)
+
+    def read(self) -> int:
+        if self._register is not None:
+            return struct.unpack_from("<I", self._register, self.GPLEV0)[0]
+
+        levels = 0
+        for pin in self.pins:
+            if self.gpio.input(pin) == 1:
+                levels |= 1 << pin
+
+        return levels
+
+
+def start_timer(seconds: float, callback: Callable[[], None]) -> threading.Timer:
+    timer = threading.Timer(seconds, callback)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+class InputEngine:
+    """
+    Edge triggered zone inputs.
+
+    Every edge is reported to on_change right away, a rising edge is reported to on_active
+    once the input has stayed high for its debounce time. When dispatch is given, edges are
+    handed to it (e.g. an event loop's call_soon) instead of being handled on the GPIO thread.
+    reconcile compares a level snapshot against the last handled edges, an input that differs
+    on two calls in a row has missed an edge and is handled as if the edge had arrived.
+    """
+    def __init__(self, gpio, schedule: Callable[[float, Callable[[], None]], object] = start_timer,
+                 dispatch: Optional[Callable[..., None]] = None):
+        self.gpio = gpio
+        self.schedule = schedule
+        self.dispatch = dispatch
+        self.inputs: dict[int, object] = {}
+        self.active: set[str] = set()
+        self.values: dict[int, bool] = {}
+        self.resyncs: int = 0
+        self.on_change: Optional[Callable[[object, bool], None]] = None
+        self.on_active: Optional[Callable[[object], None]] = None
+        self._debounce: dict[int, object] = {}
+        self._edges: dict[int, int] = {}
+        self._mismatch: set[int] = set()
+        self._lock: threading.Lock = threading.Lock()
+
+    def add(self, gpio_input) -> None:
+        self.gpio.setup(gpio_input.gpio, self.gpio.IN)
+        self.inputs[gpio_input.gpio] = gpio_input
+
+    def start(self, on_change: Callable[[object, bool], None], on_active: Callable[[object], None]) -> None:
+        self.on_change = on_change
+        self.on_active = on_active
+
+        for gpio in self.inputs:
+            self.gpio.add_event_detect(gpio, self.gpio.BOTH, callback=self._event)
+            self._edge(gpio)  # pick up inputs that are already active
+
+        logging.info("Edge detection started for inputs: %s", list(self.inputs.values()))
+
+    def stop(self) -> None:
+        for gpio in self.inputs:
+            self.gpio.remove_event_detect(gpio)
+
+        with self._lock:
+            for handle in self._debounce.values():
+                handle.cancel()
+            self._debounce.clear()
+
+    def _event(self, gpio: int) -> None:
+        if self.dispatch is not None:
+            self.dispatch(self._edge, gpio)
+        else:
+            self._edge(gpio)
+
+    def _edge(self, gpio: int) -> None:
+        gpio_input = self.inputs[gpio]
+        value = self.gpio.input(gpio) == 1
+
+        with self._lock:
+            handle = self._debounce.pop(gpio, None)
+            if handle is not None:
+                handle.cancel()
+
+            edge = self._edges[gpio] = self._edges.get(gpio, 0) + 1
+            self.values[gpio] = value
+
+            if value:
+                self._debounce[gpio] = self.schedule(gpio_input.debounce, lambda: self._settled(gpio, edge))
+            else:
+                self.active.discard(gpio_input.key)
+
+        self.on_change(gpio_input, value)
+
+    def reconcile(self, levels: int) -> None:
+        for gpio, gpio_input in self.inputs.items():
+            if bool(levels >> gpio & 1) == self.values.get(gpio):
+                self._mismatch.discard(gpio)
+                continue
+
+            # The first time the edge may still be on its way through dispatch
+            if gpio not in self._mismatch:
+                self._mismatch.add(gpio)
+                continue
+
+            self._mismatch.discard(gpio)
+            self.resyncs += 1
+            logging.warning("Missed edge on input %s, resynced from pin level", gpio_input)
+            self._edge(gpio)
+
+    def _settled(self, gpio: int, edge: int) -> None:
+        gpio_input = self.inputs[gpio]
+
+        with self._lock:
+            # A later edge has superseded this debounce timer
+            if self._edges[gpio] != edge:
+                return
+
+            self._debounce.pop(gpio, None)
+
+            if self.gpio.input(gpio) != 1:
+                return
+
+            self.active.add(gpio_input.key)
+
+        self.on_active(gpio_input)
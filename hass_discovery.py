@@ -1,9 +1,33 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
 import json
-import paho.mqtt.client as mqtt
+import logging
+from typing import TYPE_CHECKING
+
 from hass_entities import entities
 
+if TYPE_CHECKING:
+    import paho.mqtt.client as mqtt
+
+DISCOVERY_TOPICS = "homeassistant/+/rpi_alarm/+/config"
+
+
+def state_source(data_key: str, delta_topics: bool) -> dict:
+    if delta_topics:
+        return {
+            "state_topic": "home/alarm_test/state/" + data_key.replace(".", "/"),
+            "value_template": "{{ value_json }}"
+        }
+
+    return {
+        "value_template": "{{ value_json." + data_key + " }}"
+    }
+
 
-def discovery(client: mqtt.Client, zones, zone_timers) -> None:
+def build_payloads(zones, zone_timers, delta_topics: bool = False) -> dict[str, bytes]:
+    payloads = {}
     payload_common = {
         "state_topic": "home/alarm_test",
         "enabled_by_default": True,
@@ -25,9 +49,7 @@ def discovery(client: mqtt.Client, zones, zone_timers) -> None:
         }
 
         if entity.data_key is not None:
-            payload = payload | {
-                "value_template": "{{ value_json." + entity.data_key + " }}"
-            }
+            payload = payload | state_source(entity.data_key, delta_topics)
 
         if entity.component == "binary_sensor":
             payload = payload | {
@@ -84,8 +106,7 @@ def discovery(client: mqtt.Client, zones, zone_timers) -> None:
                 "unit_of_measurement": entity.unit
             }
 
-        client.publish(f'homeassistant/{entity.component}/rpi_alarm/{entity.id}/config',
-                       json.dumps(payload), retain=True)
+        payloads[f'homeassistant/{entity.component}/rpi_alarm/{entity.id}/config'] = json.dumps(payload).encode()
 
     for key, zone in zones.items():
         if zone.dev_class.value is None:
@@ -94,27 +115,28 @@ def discovery(client: mqtt.Client, zones, zone_timers) -> None:
             "name": zone.label,
             "unique_id": "rpi_alarm_" + key,
             "device_class": zone.dev_class.value,
-            "value_template": "{{ value_json.zones." + key + " }}",
             "payload_off": False,
             "payload_on": True,
-        }
+        } | state_source(f"zones.{key}", delta_topics)
 
-        client.publish(f'homeassistant/binary_sensor/rpi_alarm/{key}/config',
-                       json.dumps(payload), retain=True)
+        payloads[f'homeassistant/binary_sensor/rpi_alarm/{key}/config'] = json.dumps(payload).encode()
 
     for key, timer in zone_timers.items():
         payload_binary_sensor = payload_common | {
             "name": timer.label + " timer",
             "unique_id": "rpi_alarm_timer_" + key,
-            "value_template": "{{ value_json.zone_timers." + key + ".value }}",
             "json_attributes_topic": "home/alarm_test",
             "json_attributes_template": "{{ value_json.zone_timers." + key + ".attributes | tojson }}",
             "payload_off": False,
             "payload_on": True,
             "icon": "mdi:timer"
-        }
-        client.publish(f'homeassistant/binary_sensor/rpi_alarm/timer_{key}/config',
-                       json.dumps(payload_binary_sensor), retain=True)
+        } | state_source(f"zone_timers.{key}.value", delta_topics)
+
+        if delta_topics:
+            del payload_binary_sensor["json_attributes_template"]
+            payload_binary_sensor["json_attributes_topic"] = f"home/alarm_test/state/zone_timers/{key}/attributes"
+        payloads[f'homeassistant/binary_sensor/rpi_alarm/timer_{key}/config'] = \
+            json.dumps(payload_binary_sensor).encode()
 
         payload_button = payload_common | {
             "name": timer.label + " timer cancel",
@@ -123,17 +145,66 @@ def discovery(client: mqtt.Client, zones, zone_timers) -> None:
             "command_topic": "home/alarm_test/action",
             "icon": "mdi:timer-cancel"
         }
-        client.publish(f'homeassistant/button/rpi_alarm/timer_cancel_{key}/config',
-                       json.dumps(payload_button), retain=True)
+        payloads[f'homeassistant/button/rpi_alarm/timer_cancel_{key}/config'] = json.dumps(payload_button).encode()
 
     alarm_control_panel = payload_common | {
         "name": "Panel",
         "unique_id": "rpi_alarm_panel",
-        "value_template": "{{ value_json.state }}",
         "command_topic": "home/alarm_test/set",
         "code": "REMOTE_CODE",
         "command_template": "{ \"action\": \"{{ action }}\", \"code\": \"{{ code }}\" }"
-    }
-
-    client.publish(f'homeassistant/alarm_control_panel/rpi_alarm/alarm_panel/config',
-                   json.dumps(alarm_control_panel), retain=True)
+    } | state_source("state", delta_topics)
+
+    payloads['homeassistant/alarm_control_panel/rpi_alarm/alarm_panel/config'] = \
+        json.dumps(alarm_control_panel).encode()
+
+    return payloads
+
+
+class Discovery:
+    """
+    Home Assistant discovery payloads, serialized once and published as a diff.
+
+    On connect the retained discovery topics are read back from the broker for a moment,
+    only payloads whose hash differs from the retained copy are published, and retained
+    entities that no longer exist are removed with an empty payload. Publishing is paced
+    at rate messages per second so the burst does not hold up sensor traffic.
+    """
+    def __init__(self, zones, zone_timers, delta_topics: bool = False, rate: float = 50, settle: float = 1):
+        self.payloads: dict[str, bytes] = build_payloads(zones, zone_timers, delta_topics)
+        self.hashes: dict[str, bytes] = {topic: hashlib.sha1(p).digest() for topic, p in self.payloads.items()}
+        self.rate = rate
+        self.settle = settle
+        self.retained: dict[str, bytes] = {}
+        self.requested: bool = False
+
+    def _on_retained(self, client: mqtt.Client, userdata, msg: mqtt.MQTTMessage) -> None:
+        # Called from the paho network thread
+        if msg.retain and msg.payload:
+            self.retained[msg.topic] = hashlib.sha1(msg.payload).digest()
+
+    async def publish(self, client: mqtt.Client) -> None:
+        self.retained = {}
+        client.message_callback_add(DISCOVERY_TOPICS, self._on_retained)
+        client.subscribe(DISCOVERY_TOPICS)
+
+        try:
+            await asyncio.sleep(self.settle)  # retained messages arrive right after subscribing
+        finally:
+            client.unsubscribe(DISCOVERY_TOPICS)
+            client.message_callback_remove(DISCOVERY_TOPICS)
+
+        retained = self.retained
+        changed = [topic for topic, digest in self.hashes.items() if retained.get(topic) != digest]
+        stale = [topic for topic in retained if topic not in self.payloads]
+
+        for topic in changed:
+            client.publish(topic, self.payloads[topic], retain=True)
+            await asyncio.sleep(1 / self.rate)
+
+        for topic in stale:
+            client.publish(topic, b"", retain=True)
+            await asyncio.sleep(1 / self.rate)
+
+        logging.info("Home Assistant discovery: %d of %d published, %d removed",
+                     len(changed), len(self.payloads), len(stale))
@@ -82,6 +82,26 @@ entities = [
         label="Battery",
         category="diagnostic"
     ),
+    Entity(
+        id="battery_runtime",
+        data_key="battery_runtime",
+        component="sensor",
+        dev_class="duration",
+        state_class="measurement",
+        unit="h",
+        label="Battery runtime",
+        category="diagnostic"
+    ),
+    Entity(
+        id="battery_capacity",
+        data_key="battery_capacity",
+        component="sensor",
+        state_class="measurement",
+        unit="%",
+        label="Battery capacity",
+        icon="battery-heart-variant",
+        category="diagnostic"
+    ),
     Entity(
         id="battery_low",
         data_key="battery_low",
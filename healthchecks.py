@@ -1,43 +1,108 @@
+import time
+import random
 import logging
-import socket
-import urllib.request
 import threading
+import http.client
+from collections import deque
+from typing import Callable
+
+from keepalive import KeepAlive
 
 
 class HealthChecks:
-    def __init__(self, hc_uuid: str):
-        self.hc_uuid = hc_uuid
-        self.lock = threading.Lock()
+    """
+    Healthchecks.io pings queued for a single worker thread on one keep-alive connection.
+
+    ping, start and stop only queue the ping and never block the caller. Failed pings are
+    retried with exponential backoff and jitter, when the queue is full the oldest ping is
+    dropped. The result of every ping is passed to on_result (called on the worker thread)
+    and kept per check in status, with the latency of the last successful ping.
+    """
+    def __init__(self, uuids: dict[str, str], host: str = "hc-ping.com", port: int = 443, tls: bool = True,
+                 max_queue: int = 50, attempts: int = 5, on_result: Callable[[str, bool], None] = None):
+        self.uuids = {check: uuid for check, uuid in uuids.items() if uuid}
+        self.host = host
+        self.port = port
+        self.tls = tls
+        self.attempts = attempts
+        self.on_result = on_result
+        self.status: dict[str, dict] = {check: {"ok": None, "latency": None, "failures": 0} for check in self.uuids}
+        self._queue: deque[tuple[str, str]] = deque(maxlen=max_queue)
+        self._condition: threading.Condition = threading.Condition()
+        self._http: KeepAlive = KeepAlive(host, port, tls)
+        self._worker: threading.Thread = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
 
-    def ping(self, start: bool = False) -> bool:
-        if self.hc_uuid is None:
+    def ping(self, check: str, signal: str = "") -> bool:
+        # signal is "" for success, "start" or "fail"
+        if check not in self.uuids:
             return False
 
-        ping_url = f"https://hc-ping.com/{self.hc_uuid}"
+        with self._condition:
+            if len(self._queue) == self._queue.maxlen:
+                logging.error("Healthchecks queue full, dropped ping: %s", self._queue[0][0])
+            self._queue.append((check, signal))
+            self._condition.notify()
 
-        if start:
-            ping_url += "/start"
+        return True
 
-        try:
-            urllib.request.urlopen(ping_url, timeout=10)
-            return True
+    def start(self, check: str) -> bool:
+        return self.ping(check, "start")
 
-        except socket.error as e:
-            logging.error("Healthchecks returned error: %s", e)
-            return False
+    def stop(self, check: str) -> bool:
+        return self.ping(check)
+
+    def fail(self, check: str) -> bool:
+        return self.ping(check, "fail")
+
+    def pending(self) -> int:
+        with self._condition:
+            return len(self._queue)
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                check, signal = self._queue.popleft()
+
+            ok = self._deliver(check, signal)
+
+            if self.on_result is not None:
+                self.on_result(check, ok)
+
+    def _deliver(self, check: str, signal: str) -> bool:
+        path = f"/{self.uuids[check]}/{signal}" if signal else f"/{self.uuids[check]}"
+        backoff = 1
+
+        for attempt in range(self.attempts):
+            if attempt:
+                # Jitter keeps retries from lining up with the other checks
+                time.sleep(backoff * random.uniform(0.5, 1.5))
+                backoff = min(backoff * 2, 60)
+
+            start_time = time.monotonic()
 
-    def start(self) -> bool:
-        ping_result = self.ping(True)
+            try:
+                status = self._request(path)
+            except (OSError, http.client.HTTPException) as e:
+                logging.warning("Healthchecks ping %s failed: %s", check, e)
+                continue
 
-        if ping_result:
-            self.lock.acquire()
+            if status == 200:
+                self.status[check] |= {"ok": True, "latency": round(time.monotonic() - start_time, 3)}
+                return True
 
-        return ping_result
+            logging.warning("Healthchecks ping %s returned %d", check, status)
 
-    def stop(self) -> bool:
-        ping_result = self.ping()
+            if 400 <= status < 500 and status != 429:
+                break
 
-        if ping_result:
-            self.lock.release()
+        self.status[check]["ok"] = False
+        self.status[check]["failures"] += 1
+        logging.error("Healthchecks ping %s not delivered", check)
+        return False
 
-        return ping_result
+    def _request(self, path: str) -> int:
+        response, _ = self._http.request("HEAD", path)
+        return response.status
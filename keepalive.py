@@ -0,0 +1,45 @@
+import http.client
+from typing import Optional
+
+
+class KeepAlive:
+    """
+    One keep-alive HTTP(S) connection for a single worker thread.
+
+    An idle connection may have been closed by the server, a request failing on a reused
+    connection is repeated once on a new one. Any other failure is raised to the caller.
+    """
+    def __init__(self, host: str, port: int = 443, tls: bool = True, timeout: float = 10):
+        self.host = host
+        self.port = port
+        self.tls = tls
+        self.timeout = timeout
+        self._conn: Optional[http.client.HTTPConnection] = None
+
+    def request(self, method: str, path: str, body: str = None,
+                headers: dict[str, str] = None) -> tuple[http.client.HTTPResponse, bytes]:
+        for reused in [self._conn is not None, False]:
+            if self._conn is None:
+                connection = http.client.HTTPSConnection if self.tls else http.client.HTTPConnection
+                self._conn = connection(self.host, self.port, timeout=self.timeout)
+
+            try:
+                self._conn.request(method, path, body, headers or {})
+                response = self._conn.getresponse()
+                data = response.read()
+            except (OSError, http.client.HTTPException):
+                self.close()
+
+                if reused:
+                    continue
+                raise
+
+            if response.will_close:
+                self.close()
+
+            return response, data
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
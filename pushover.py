@@ -1,15 +1,57 @@
 import time
+import heapq
+import itertools
+import logging
 import threading
 import http.client
 import urllib.parse
+from typing import Optional
+
+from keepalive import KeepAlive
+from spool import Spool
 
 
 class Pushover:
-    def __init__(self, token: str, user: str):
+    """
+    Queued Pushover delivery on a single worker thread and keep-alive connection.
+
+    Messages are sent by priority (emergency first) then in order. When the queue is full
+    the newest message of the lowest priority is dropped to make room for a more important one.
+    Failed requests are retried with exponential backoff, a rate limited request waits for
+    the reset time given in the X-Limit-App-Reset header.
+
+    With a spool, messages are written to disk before push returns and kept until delivered,
+    rejected or older than max_age, so alerts raised while offline are sent once the network is back.
+    A message with the same key as one still waiting is not queued again.
+    """
+    def __init__(self, token: str, user: str, host: str = "api.pushover.net", port: int = 443, tls: bool = True,
+                 max_queue: int = 100, spool: Optional[Spool] = None, max_age: float = 12 * 3600):
         self.token = token
         self.user = user
+        self.host = host
+        self.port = port
+        self.tls = tls
+        self.max_queue = max_queue
+        self.spool = spool
+        self.max_age = max_age
+        self.limit_remaining: Optional[int] = None
+        self.limit_reset: Optional[int] = None
+        self.stats: dict[str, int] = {"sent": 0, "failed": 0, "dropped": 0, "retries": 0}
+        self._queue: list[tuple] = []
+        self._keys: set[str] = set()
+        self._order = itertools.count()
+        self._condition: threading.Condition = threading.Condition()
+        self._http: KeepAlive = KeepAlive(host, port, tls)
+        self._worker: threading.Thread = threading.Thread(target=self._run, daemon=True)
+
+        if spool is not None:
+            for entry_id, entry in spool.pending():
+                self._enqueue((-entry["priority"], entry_id, entry))
+            logging.info("Pushover messages restored from spool: %d", len(self._queue))
 
-    def _push(self, title:str, message: str, priority: int, data: dict) -> None:
+        self._worker.start()
+
+    def _payload(self, title: str, message: str, priority: int, data: dict, timestamp: float) -> str:
         if priority == 2:
             data = {
                 "sound": "alien",
@@ -18,20 +60,133 @@ class Pushover:
                 "expire": 3600
             }
 
-        conn = http.client.HTTPSConnection("api.pushover.net:443")
-        conn.request("POST", "/1/messages.json",
-                     urllib.parse.urlencode({
-                         "token": self.token,
-                         "user": self.user,
-                         "title": title,
-                         "message": message,
-                         "timestamp": time.time(),
-                         "sound": "gamelan"
-                     } | data), {"Content-type": "application/x-www-form-urlencoded"})
-        conn.getresponse()
-
-    def push(self, title: str, message: str, priority: int = 0, data: dict = None) -> None:
+        return urllib.parse.urlencode({
+            "token": self.token,
+            "user": self.user,
+            "title": title,
+            "message": message,
+            "timestamp": timestamp,
+            "sound": "gamelan"
+        } | data)
+
+    def push(self, title: str, message: str, priority: int = 0, data: dict = None, key: str = None) -> None:
         if data is None:
             data = {}
 
-        threading.Thread(target=self._push, args=(title, message, priority, data,)).start()
+        entry = {
+            "title": title,
+            "key": key or f"{title}|{message}",
+            "priority": priority,
+            "created": time.time(),
+            "payload": self._payload(title, message, priority, data, time.time())
+        }
+
+        with self._condition:
+            if entry["key"] in self._keys:
+                logging.debug("Pushover message already queued: %s", title)
+                return
+
+        # Written before returning, emergencies are synced without waiting for the next batch
+        entry_id = self.spool.add(entry, sync=priority == 2) if self.spool is not None else None
+        self._enqueue((-priority, entry_id or 0, entry))
+
+    def _enqueue(self, item: tuple) -> None:
+        # Ordered by priority, then spool id (older first), the tie breaker keeps entries uncompared
+        item = (item[0], item[1], next(self._order), item[2])
+
+        with self._condition:
+            if len(self._queue) >= self.max_queue:
+                lowest = max(self._queue)
+
+                if lowest < item:
+                    self._drop(item)
+                    return
+
+                self._queue.remove(lowest)
+                heapq.heapify(self._queue)
+                self._keys.discard(lowest[3]["key"])
+                self._drop(lowest)
+
+            heapq.heappush(self._queue, item)
+            self._keys.add(item[3]["key"])
+            self._condition.notify()
+
+    def _drop(self, item: tuple) -> None:
+        self.stats["dropped"] += 1
+        logging.error("Pushover queue full, dropped: %s", item[3]["title"])
+        self._finish(item)
+
+    def _finish(self, item: tuple) -> None:
+        if self.spool is not None and item[1]:
+            self.spool.done(item[1])
+
+    def pending(self) -> int:
+        with self._condition:
+            return len(self._queue)
+
+    def _run(self) -> None:
+        backoff = 1
+
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                item = heapq.heappop(self._queue)
+
+            entry = item[3]
+
+            if time.time() - entry["created"] > self.max_age:
+                logging.error("Pushover message expired: %s", entry["title"])
+                self.stats["failed"] += 1
+            else:
+                wait = self._deliver(entry)
+
+                if wait is not None:
+                    # Not delivered, back in the queue so newer emergencies still go first
+                    with self._condition:
+                        heapq.heappush(self._queue, item)
+                    self.stats["retries"] += 1
+                    time.sleep(max(wait, backoff))
+                    backoff = min(backoff * 2, 60)
+                    continue
+
+            backoff = 1
+
+            with self._condition:
+                self._keys.discard(entry["key"])
+            self._finish(item)
+
+    def _deliver(self, entry: dict) -> Optional[float]:
+        # Returns how long to wait before trying again, None when done with the message
+        try:
+            status, body = self._request(entry["payload"])
+        except (OSError, http.client.HTTPException) as e:
+            logging.warning("Pushover request failed: %s", e)
+            return 0
+
+        if status == 200:
+            self.stats["sent"] += 1
+            return None
+
+        if status == 429:
+            # Rate limited, no point in trying before the limit resets
+            logging.error("Pushover rate limited, remaining: %s", self.limit_remaining)
+            return min((self.limit_reset or 0) - time.time(), 300)
+
+        if 400 <= status < 500:
+            logging.error("Pushover rejected %s (%d): %s", entry["title"], status, body)
+            self.stats["failed"] += 1
+            return None
+
+        logging.warning("Pushover returned %d", status)
+        return 0
+
+    def _request(self, payload: str) -> tuple[int, bytes]:
+        response, body = self._http.request("POST", "/1/messages.json", payload,
+                                            {"Content-type": "application/x-www-form-urlencoded"})
+
+        if response.getheader("X-Limit-App-Remaining") is not None:
+            self.limit_remaining = int(response.getheader("X-Limit-App-Remaining"))
+            self.limit_reset = int(response.getheader("X-Limit-App-Reset", "0"))
+
+        return response.status, body
@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import threading
+from typing import Callable, Coroutine, Optional
+
+
+class Runtime:
+    """
+    Single asyncio event loop for alarm flows, periodic checks and message handling.
+
+    Flows run as named tasks: checking whether a flow is running replaces lock checks,
+    and stopping a flow is a task cancellation. Other threads (paho network loop, GPIO
+    callbacks, serial reader) hand work to the loop with call_soon.
+
+    Deadlines are keyed loop timers (the loop keeps them in a heap), re-arming a key
+    replaces its previous deadline, so timeouts cost nothing until they expire.
+    """
+    def __init__(self):
+        self.loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
+        self.tasks: dict[str, asyncio.Task] = {}
+        self.deadlines: dict[str, asyncio.TimerHandle] = {}
+        self._background: set[asyncio.Task] = set()
+        self._thread: Optional[threading.Thread] = None
+
+    def run(self, main: Callable[[], Coroutine]) -> None:
+        self._thread = threading.current_thread()
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(main())
+
+    def call_soon(self, callback: Callable, *args) -> None:
+        if threading.current_thread() is self._thread:
+            self.loop.call_soon(callback, *args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def call_later(self, seconds: float, callback: Callable, *args) -> asyncio.TimerHandle:
+        return self.loop.call_later(seconds, callback, *args)
+
+    def deadline(self, key: str, seconds: float, callback: Callable, *args, replace: bool = True) -> None:
+        handle = self.deadlines.get(key)
+
+        if handle is not None:
+            if not replace:
+                return
+            handle.cancel()
+
+        self.deadlines[key] = self.loop.call_later(seconds, self._expire, key, callback, args)
+
+    def cancel_deadline(self, key: str) -> None:
+        handle = self.deadlines.pop(key, None)
+
+        if handle is not None:
+            handle.cancel()
+
+    def _expire(self, key: str, callback: Callable, args: tuple) -> None:
+        del self.deadlines[key]
+        callback(*args)
+
+    def running(self, *names: str) -> bool:
+        return any(name in self.tasks and not self.tasks[name].done() for name in names)
+
+    def spawn(self, name: Optional[str], func: Callable[..., Coroutine], *args) -> bool:
+        if name is not None and self.running(name):
+            return False
+
+        task = self.loop.create_task(func(*args), name=name)
+        task.add_done_callback(self._done)
+
+        if name is not None:
+            self.tasks[name] = task
+        else:
+            self._background.add(task)
+
+        return True
+
+    def cancel(self, *names: str) -> None:
+        current = asyncio.current_task(self.loop) if self.loop.is_running() else None
+
+        for name in names:
+            task = self.tasks.get(name)
+            if task is not None and task is not current and not task.done():
+                logging.debug("Cancelling task: %s", name)
+                task.cancel()
+
+    def _done(self, task: asyncio.Task) -> None:
+        self._background.discard(task)
+
+        if task.cancelled():
+            return
+
+        if task.exception() is not None:
+            logging.error("Task %s failed", task.get_name(), exc_info=task.exception())
@@ -0,0 +1,74 @@
+import json
+import logging
+import threading
+import time
+from typing import Any
+
+from atomic import atomic_write
+
+
+class Settings:
+    """
+    Settings changed at runtime (e.g. from Home Assistant), kept apart from the static config.ini.
+
+    Changes are applied in memory right away and written by a background thread: updates
+    within min_interval are merged into one write, replacing the file atomically so a crash
+    never leaves a truncated file.
+    """
+    def __init__(self, path: str = "settings.json", min_interval: float = 10):
+        self.path = path
+        self.min_interval = min_interval
+        self.data: dict[str, dict[str, Any]] = {}
+        self.writes: int = 0
+        self._dirty: threading.Event = threading.Event()
+        self._lock: threading.Lock = threading.Lock()
+        self._write_lock: threading.Lock = threading.Lock()
+        self._writer: threading.Thread = threading.Thread(target=self._write_loop, daemon=True)
+
+        try:
+            with open(path) as f:
+                self.data = json.load(f)
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            logging.error("Unable to read settings from %s: %s", path, e)
+
+        self._writer.start()
+
+    def get(self, section: str, option: str, fallback: Any = None) -> Any:
+        with self._lock:
+            return self.data.get(section, {}).get(option, fallback)
+
+    def set(self, section: str, option: str, value: Any) -> None:
+        with self._lock:
+            if self.data.get(section, {}).get(option) == value:
+                return
+            self.data.setdefault(section, {})[option] = value
+
+        self._dirty.set()
+
+    def flush(self) -> None:
+        with self._write_lock:
+            if self._dirty.is_set():
+                self._dirty.clear()
+                self._write()
+
+    def _write_loop(self) -> None:
+        while True:
+            self._dirty.wait()
+            time.sleep(self.min_interval)  # let more changes arrive before writing
+            self.flush()
+
+    def _write(self) -> None:
+        with self._lock:
+            payload = json.dumps(self.data, indent=2, sort_keys=True)
+
+        try:
+            atomic_write(self.path, payload.encode())
+        except OSError as e:
+            logging.error("Unable to write settings to %s: %s", self.path, e)
+            self._dirty.set()  # try again on the next round
+            return
+
+        self.writes += 1
+        logging.debug("Settings written to %s", self.path)
@@ -0,0 +1,121 @@
+import json
+import logging
+import os
+import threading
+from typing import Optional
+
+from atomic import atomic_write
+
+
+class Spool:
+    """
+    On-disk, append-only spool of outgoing notifications.
+
+    An entry is appended ("add") before it is queued for delivery and marked ("done") once
+    delivered, rejected or expired, entries without a done record are sent again after a
+    restart. Appends are fsynced by a background thread in batches every sync_interval,
+    urgent entries wake it up right away so the caller never waits for the disk.
+    The file is rewritten with only the pending entries once it grows past max_bytes.
+    """
+    def __init__(self, path: str = "notifications.spool", sync_interval: float = 0.5, max_bytes: int = 256 * 1024):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.max_bytes = max_bytes
+        self.entries: dict[int, dict] = {}
+        self._next_id: int = 1
+        self._size: int = 0
+        self._fd: Optional[int] = None
+        self._lock: threading.Lock = threading.Lock()
+        self._dirty: threading.Event = threading.Event()
+        self._urgent: threading.Event = threading.Event()
+
+        try:
+            with open(path, "rb") as f:
+                for line in f:
+                    try:
+                        self._replay(json.loads(line))
+                    except (ValueError, KeyError):
+                        logging.warning("Skipping damaged spool record: %s", line[:80])
+        except FileNotFoundError:
+            pass
+
+        with self._lock:
+            self._compact()
+
+        threading.Thread(target=self._sync_loop, daemon=True).start()
+
+    def add(self, entry: dict, sync: bool = False) -> int:
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self.entries[entry_id] = entry
+            self._append({"add": entry_id, "entry": entry}, sync)
+
+        return entry_id
+
+    def done(self, entry_id: int) -> None:
+        with self._lock:
+            if self.entries.pop(entry_id, None) is None:
+                return
+
+            if self._size > self.max_bytes:
+                self._compact()
+            else:
+                self._append({"done": entry_id})
+
+    def pending(self) -> list[tuple[int, dict]]:
+        with self._lock:
+            return list(self.entries.items())
+
+    def _replay(self, record: dict) -> None:
+        if "add" in record:
+            self.entries[record["add"]] = record["entry"]
+            self._next_id = max(self._next_id, record["add"] + 1)
+        else:
+            self.entries.pop(record["done"], None)
+
+    def _append(self, record: dict, sync: bool = False) -> None:
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode()
+
+        try:
+            os.write(self._fd, line)
+        except (OSError, TypeError) as e:
+            logging.error("Unable to write notification spool: %s", e)
+            return
+
+        self._size += len(line)
+        self._dirty.set()
+        if sync:
+            self._urgent.set()
+
+    def _compact(self) -> None:
+        lines = [json.dumps({"add": entry_id, "entry": entry}, separators=(",", ":")) + "\n"
+                 for entry_id, entry in self.entries.items()]
+        payload = "".join(lines).encode()
+
+        try:
+            atomic_write(self.path, payload)
+
+            if self._fd is not None:
+                os.close(self._fd)
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+        except OSError as e:
+            logging.error("Unable to compact notification spool: %s", e)
+            return
+
+        self._size = len(payload)
+
+    def _sync_loop(self) -> None:
+        while True:
+            self._dirty.wait()
+            self._urgent.wait(self.sync_interval)  # one fsync for everything appended meanwhile
+            self._dirty.clear()
+            self._urgent.clear()
+
+            with self._lock:
+                fd = self._fd
+
+            try:
+                os.fsync(fd)
+            except (OSError, TypeError):
+                pass  # replaced by a compaction, which synced the new file itself
@@ -0,0 +1,142 @@
+import json
+import logging
+import mmap
+import os
+import threading
+from typing import Optional
+
+from atomic import atomic_write
+
+# Keys holding a dictionary that records update entry by entry, everything else is replaced
+MERGED_KEYS = {"zones", "zone_timers", "notify"}
+
+
+class StateLog:
+    """
+    Append-only log of state changes.
+
+    Every record is one JSON line holding only the changed keys, replaying the
+    lines in order gives the current state. Once the log grows past max_bytes it is
+    compacted into a single line, written to a temporary file and renamed over
+    the log so a crash leaves either the old or the new file. A torn last line
+    (power cut while appending) is skipped on load.
+
+    append only updates the in-memory state and queues the line, a writer thread
+    does the writes and fsyncs (once for every batch holding a synced record), so
+    the caller never waits for the SD card. flush waits until everything is written.
+    """
+    def __init__(self, path: str = "state.log", max_bytes: int = 64 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.state: dict = {}
+        self._size: int = 0
+        self._fd: Optional[int] = None
+        self._lock: threading.Lock = threading.Lock()
+        self._condition: threading.Condition = threading.Condition()
+        self._queue: list[tuple[bytes, bool]] = []
+        self._busy: bool = False
+        self._writer: Optional[threading.Thread] = None
+
+    def load(self) -> dict:
+        self.state = {}
+
+        try:
+            with open(self.path, "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    for line in iter(mm.readline, b""):
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            record = None
+
+                        # A torn line can still parse, as a number for instance
+                        if not isinstance(record, dict):
+                            logging.warning("Skipping damaged state log record: %s", line[:80])
+                            continue
+
+                        self._merge(record)
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            pass  # empty file, nothing to map
+
+        self.compact()
+
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._write_loop, daemon=True)
+            self._writer.start()
+
+        return self.state
+
+    def append(self, changes: dict, sync: bool = False) -> None:
+        with self._lock:
+            self._merge(changes)
+            line = (json.dumps(changes, separators=(",", ":")) + "\n").encode()
+
+        with self._condition:
+            self._queue.append((line, sync))
+            self._condition.notify_all()
+
+    def flush(self) -> None:
+        with self._condition:
+            while self._queue or self._busy:
+                self._condition.wait()
+
+    def compact(self) -> None:
+        with self._lock:
+            snapshot = json.dumps(self.state, separators=(",", ":"))
+
+        self._compact(snapshot)
+
+    def _write_loop(self) -> None:
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                batch, self._queue = self._queue, []
+                self._busy = True
+
+            self._write(batch)
+
+            with self._condition:
+                self._busy = False
+                self._condition.notify_all()
+
+    def _write(self, batch: list[tuple[bytes, bool]]) -> None:
+        data = b"".join(line for line, _ in batch)
+
+        if self._fd is None or self._size + len(data) > self.max_bytes:
+            self.compact()  # the state already holds every queued change
+            return
+
+        try:
+            os.write(self._fd, data)
+            if any(sync for _, sync in batch):
+                os.fsync(self._fd)
+        except OSError as e:
+            logging.error("Unable to write state log: %s", e)
+            return
+
+        self._size += len(data)
+
+    def _compact(self, snapshot: str) -> None:
+        line = (snapshot + "\n").encode()
+
+        try:
+            atomic_write(self.path, line)
+
+            if self._fd is not None:
+                os.close(self._fd)
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+        except OSError as e:
+            logging.error("Unable to compact state log: %s", e)
+            return
+
+        self._size = len(line)
+
+    def _merge(self, changes: dict) -> None:
+        for key, value in changes.items():
+            if key in MERGED_KEYS and isinstance(value, dict):
+                self.state.setdefault(key, {}).update(value)
+            else:
+                self.state[key] = value
@@ -0,0 +1,176 @@
+import concurrent.futures
+import logging
+import threading
+import time
+
+import pytest
+
+serial = pytest.importorskip("serial")
+
+import arduino  # noqa: E402
+from arduino import FRAME_SAMPLE, Arduino, frame, sample_frame  # noqa: E402
+
+
+class Link:
+    """Shared state of the fake serial port, up or unplugged."""
+    def __init__(self):
+        self.up = threading.Event()
+        self.up.set()
+
+
+class FakeSerial:
+    link: Link = None
+
+    def __init__(self, device: str, baudrate: int, timeout: float = None):
+        if not self.link.up.is_set():
+            raise serial.SerialException(f"could not open port {device}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+    def reset_input_buffer(self) -> None:
+        pass
+
+    def write(self, data: bytes) -> int:
+        return len(data)
+
+    def readline(self) -> bytes:
+        time.sleep(0.005)
+        if not self.link.up.is_set():
+            raise serial.SerialException("device reports readiness to read but returned no data")
+        return b"760|742|309|21.5|0|0\n"
+
+
+class StreamSerial:
+    """Port that hands out prepared bytes in fixed chunks."""
+    def __init__(self, data: bytes, chunk: int):
+        self.data = bytearray(data)
+        self.chunk = chunk
+
+    @property
+    def in_waiting(self) -> int:
+        return min(self.chunk, len(self.data))
+
+    def read(self, size: int) -> bytes:
+        chunk = bytes(self.data[:size])
+        del self.data[:size]
+        return chunk
+
+
+def sample(ai1: int = 760, temperature: int = 2150, outputs: int = 0) -> bytes:
+    return frame(sample_frame.pack(FRAME_SAMPLE, ai1, 742, 309, temperature, 0, outputs))
+
+
+def read_all(a: Arduino, data: bytes, chunk: int) -> None:
+    port = StreamSerial(data, chunk)
+    while port.data:
+        a._read_binary(port)
+
+
+def wait_for(condition, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_two_outages_in_a_row(monkeypatch, caplog):
+    FakeSerial.link = Link()
+    monkeypatch.setattr(arduino.serial, "Serial", FakeSerial)
+    a = Arduino("/dev/fake", reset_delay=0)
+    threading.Thread(target=a.get_data, daemon=True).start()
+    assert wait_for(a.connected.is_set)
+
+    with caplog.at_level(logging.ERROR):
+        for outage in [1, 2]:
+            FakeSerial.link.up.clear()
+            assert wait_for(lambda: not a.connected.is_set())
+            time.sleep(0.3)
+            FakeSerial.link.up.set()
+
+            assert wait_for(lambda: a.reconnects == outage)
+            # Measured from this outage, first retry after 0.5 s
+            assert a.reconnect_time < 1.5
+
+    lost = [r for r in caplog.records if "unavailable" in r.getMessage()]
+    assert len(lost) == 2
+
+
+@pytest.mark.parametrize("chunk", [1, 5, 64])
+def test_binary_resync_after_garbage_and_short_frame(chunk):
+    a = Arduino(protocol="binary")
+    samples = []
+    a.on_data = lambda: samples.append(a.data)
+
+    short = sample()[:9]  # cut off by a reset of the MCU
+    read_all(a, b"\x00\xff\xa5" + short + sample(temperature=2150) + b"\x5a\xa5" + sample(temperature=2200), chunk)
+
+    assert [s.temperature for s in samples] == [21.5, 21.8]
+    assert a.dropped_frames == 1  # the short frame, completed with bytes of the next one
+
+
+def test_binary_bad_checksum_dropped():
+    a = Arduino(protocol="binary")
+    samples = []
+    a.on_data = lambda: samples.append(a.data)
+
+    corrupt = bytearray(sample(ai1=1000))
+    corrupt[5] ^= 0x01
+    read_all(a, bytes(corrupt) + sample(), 64)
+
+    assert len(samples) == 1
+    assert a.dropped_frames == 1
+    assert a.data.battery_voltage == round(760 * 4.096 / 1024 * 12.004 / 2.975, 2)
+
+
+class RecordingSerial:
+    def __init__(self):
+        self.written = []
+
+    def write(self, data: bytes) -> int:
+        self.written.append(data)
+        return len(data)
+
+
+def connected_arduino() -> Arduino:
+    a = Arduino(protocol="binary")
+    a._serial = RecordingSerial()
+    a.connected.set()
+    threading.Thread(target=a._write_commands, daemon=True).start()
+    return a
+
+
+def test_command_confirmed_by_later_sample():
+    a = connected_arduino()
+
+    future = a.set_output(3, True)
+    assert wait_for(lambda: 3 in a.pending)
+    assert not future.done()
+
+    a._sample(760, 742, 309, 21.5, 0, 0)  # sampled before the command was applied
+    assert not future.done()
+
+    a._sample(760, 742, 309, 21.5, 0, 0b100)
+    assert future.result(timeout=1) >= 0
+    assert a.pending == {}
+    assert a.data.outputs[2] is True
+
+
+def test_command_not_confirmed_times_out():
+    a = connected_arduino()
+
+    future = a.set_output(5, True)
+    assert wait_for(lambda: 5 in a.pending)
+
+    for _ in range(3):
+        a._sample(760, 742, 309, 21.5, 0, 0)
+
+    with pytest.raises(concurrent.futures.TimeoutError):
+        future.result(timeout=0.2)
+    assert 5 in a.pending
+    assert a._serial.written  # sent, the MCU never applied it
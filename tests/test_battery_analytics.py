@@ -0,0 +1,33 @@
+from battery_analytics import BatteryAnalytics, sample_record
+
+
+def test_samples_kept_in_rolling_window(tmp_path):
+    samples = tmp_path / "battery_samples.bin"
+    analytics = BatteryAnalytics(str(samples), str(tmp_path / "tests.jsonl"), interval=0,
+                                 max_bytes=100 * sample_record.size)
+
+    for n in range(250):
+        analytics.record(12 + n / 1000, 90, 21.5, False)
+
+    data = samples.read_bytes()
+    assert len(data) <= 100 * sample_record.size
+    assert len(data) % sample_record.size == 0
+
+    # The newest sample is last, nothing lost since the last compaction
+    voltages = [record[1] for record in sample_record.iter_unpack(data)]
+    assert voltages[-1] == 12249
+    assert voltages == list(range(voltages[0], 12250))
+
+
+def test_torn_record_dropped(tmp_path):
+    samples = tmp_path / "battery_samples.bin"
+    samples.write_bytes(sample_record.pack(1, 12000, 50, 200, 0) * 5 + b"\x01\x02\x03")
+
+    analytics = BatteryAnalytics(str(samples), str(tmp_path / "tests.jsonl"), interval=0,
+                                 max_bytes=6 * sample_record.size)
+    analytics.record(12.5, 60, 20.0, True)
+    analytics.record(12.4, 59, 20.0, True)
+
+    records = list(sample_record.iter_unpack(samples.read_bytes()))
+    assert len(records) == 3
+    assert [r[1:4] for r in records] == [(12000, 50, 200), (12500, 60, 200), (12400, 59, 200)]
@@ -0,0 +1,98 @@
+from typing import Callable
+
+from digest import Category, Digest
+
+
+class Scheduler:
+    """Manual stand-in for the event loop's call_later, time only moves on advance."""
+    def __init__(self):
+        self.now: float = 0.0
+        self.timers: list[tuple[float, Callable, tuple]] = []
+
+    def call_later(self, seconds: float, callback: Callable, *args) -> tuple:
+        timer = (self.now + seconds, callback, args)
+        self.timers.append(timer)
+        return timer
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+        while due := sorted((t for t in self.timers if t[0] <= self.now), key=lambda t: t[0]):
+            self.timers.remove(due[0])
+            due[0][1](*due[0][2])
+
+
+def digest(**categories: Category) -> tuple[Digest, Scheduler, list]:
+    scheduler, sent = Scheduler(), []
+    return Digest(lambda *args: sent.append(args), scheduler.call_later, categories), scheduler, sent
+
+
+def test_burst_grouped_into_one_digest():
+    notifications, scheduler, sent = digest(notify=Category(60))
+
+    notifications.notify("notify", "Notify zone is open", "Front door", 1)
+    notifications.notify("notify", "Notify zone is open", "Back door")
+    notifications.notify("notify", "Notify zone is open", "Garage")
+    notifications.notify("notify", "Notify zone is open", "Back door")  # already in the digest
+
+    assert sent == [("Notify zone is open", "Front door", 1)]
+
+    scheduler.advance(59)
+    assert len(sent) == 1
+
+    scheduler.advance(1)
+    assert sent[1] == ("Notify zone is open (2)", "Back door, Garage", 0)
+    assert notifications.merged == 3
+
+
+def test_nothing_sent_without_events():
+    notifications, scheduler, sent = digest(notify=Category(60))
+
+    notifications.notify("notify", "Notify zone is open", "Front door")
+    scheduler.advance(60)  # window closes with nothing merged
+    scheduler.advance(600)
+
+    assert sent == [("Notify zone is open", "Front door", 0)]
+    assert scheduler.timers == []
+
+    # Quiet again, the next one goes out right away
+    notifications.notify("notify", "Notify zone is open", "Garage")
+    assert sent[-1] == ("Notify zone is open", "Garage", 0)
+
+
+def test_window_stays_open_while_digests_are_sent():
+    notifications, scheduler, sent = digest(notify=Category(60))
+
+    notifications.notify("notify", "Zone open", "Front door")
+    scheduler.advance(30)
+    notifications.notify("notify", "Zone open", "Back door")
+    scheduler.advance(30)
+    notifications.notify("notify", "Zone open", "Garage")
+    scheduler.advance(59)
+
+    assert [message for _, message, _ in sent] == ["Front door", "Back door"]
+
+    scheduler.advance(1)
+    assert [message for _, message, _ in sent] == ["Front door", "Back door", "Garage"]
+
+
+def test_latest_only_and_unchanged_not_sent():
+    notifications, scheduler, sent = digest(fault=Category(60, latest=True))
+
+    notifications.notify("fault", "System check(s) failed", "mqtt")
+    notifications.notify("fault", "System check(s) failed", "mqtt, arduino")
+    notifications.notify("fault", "System status restored", "All checks are OK")
+    notifications.notify("fault", "System check(s) failed", "mqtt")
+    scheduler.advance(60)
+
+    # The last state equals what was already sent
+    assert sent == [("System check(s) failed", "mqtt", 0)]
+
+
+def test_emergency_not_held_back():
+    notifications, scheduler, sent = digest(zones_open=Category(30, latest=True))
+
+    notifications.notify("zones_open", "Multiple zones triggered", "Front door, Garage", 1)
+    notifications.notify("zones_open", "Triggered", "Front door", 2)
+
+    assert sent[-1] == ("Triggered", "Front door", 2)
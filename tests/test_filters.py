@@ -0,0 +1,90 @@
+import random
+import statistics
+
+import pytest
+
+from filters import ExponentialAverage, MovingAverage, MovingMedian, RingBuffer, create_filter
+
+
+class ListWindow:
+    """The list-based window the filters replaced: append, pop(0) and statistics."""
+    def __init__(self, size: int):
+        self.size = size
+        self.values: list[float] = []
+
+    def update(self, value: float) -> None:
+        self.values.append(value)
+
+        if len(self.values) > self.size:
+            self.values.pop(0)
+
+
+def test_ring_buffer_fill_and_wrap_around():
+    ring = RingBuffer(3)
+
+    assert [ring.append(value) for value in [1, 2, 3]] == [None, None, None]
+    assert list(ring) == [1, 2, 3]
+
+    assert ring.append(4) == 1
+    assert ring.append(5) == 2
+    assert list(ring) == [3, 4, 5]
+    assert len(ring) == 3
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 4, 10, 30])
+def test_moving_average_matches_list(size):
+    values = [random.uniform(10.5, 13.5) for _ in range(size * 5 + 1)]
+    reference, average = ListWindow(size), MovingAverage(size)
+
+    for value in values:
+        reference.update(value)
+        assert average.update(value) == pytest.approx(statistics.mean(reference.values))
+        assert len(average) == len(reference.values)
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 4, 10, 11])
+def test_moving_median_matches_list(size):
+    # Integers with repeats, so equal values are evicted from the sorted window too
+    values = [random.randint(-5, 5) for _ in range(size * 5 + 1)]
+    reference, median = ListWindow(size), MovingMedian(size)
+
+    for value in values:
+        reference.update(value)
+        assert median.update(value) == statistics.median(reference.values)
+
+
+def test_even_window_median_and_average():
+    median, average = MovingMedian(4), MovingAverage(4)
+
+    for value in [8, 1, 4, 2, 100]:
+        median.update(value)
+        average.update(value)
+
+    # Window [1, 4, 2, 100] after the 8 dropped out
+    assert median.value == 3
+    assert average.value == 26.75
+
+
+def test_empty_filters():
+    assert MovingAverage(3).value is None
+    assert MovingMedian(3).value is None
+    assert ExponentialAverage(0.5).value is None
+
+
+def test_exponential_average():
+    ema = ExponentialAverage(0.5)
+
+    assert ema.update(10) == 10
+    assert ema.update(20) == 15
+    assert ema.update(20) == 17.5
+    assert len(ema) == 3
+
+
+def test_create_filter():
+    assert isinstance(create_filter("mean:3"), MovingAverage)
+    assert isinstance(create_filter("ema:0.3"), ExponentialAverage)
+    assert isinstance(create_filter("median:10"), MovingMedian)
+
+    for spec in ["mode:3", "mean:0", "ema:2"]:
+        with pytest.raises(ValueError):
+            create_filter(spec)
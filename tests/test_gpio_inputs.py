@@ -0,0 +1,162 @@
+from dataclasses import dataclass
+
+from gpio_inputs import FakeGPIO, GpioLevels, InputEngine
+
+
+@dataclass
+class FakeInput:
+    key: str
+    gpio: int
+    debounce: float = 0.05
+
+
+class ManualTimer:
+    def __init__(self, seconds: float, callback):
+        self.seconds = seconds
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+
+class Scheduler:
+    """Debounce timers that only fire when the test says so."""
+    def __init__(self):
+        self.timers: list[ManualTimer] = []
+
+    def __call__(self, seconds: float, callback) -> ManualTimer:
+        timer = ManualTimer(seconds, callback)
+        self.timers.append(timer)
+        return timer
+
+    def fire(self) -> None:
+        timers, self.timers = self.timers, []
+        for timer in timers:
+            if not timer.cancelled:
+                timer.callback()
+
+
+def make_engine(*inputs: FakeInput):
+    gpio = FakeGPIO()
+    scheduler = Scheduler()
+    engine = InputEngine(gpio, schedule=scheduler)
+    changes, activations = [], []
+
+    for gpio_input in inputs:
+        engine.add(gpio_input)
+    engine.start(lambda i, value: changes.append((i.key, value)), lambda i: activations.append(i.key))
+
+    return gpio, scheduler, engine, changes, activations
+
+
+def test_edge_reported_right_away():
+    gpio, scheduler, engine, changes, activations = make_engine(FakeInput("zone01", 5))
+
+    gpio.set_input(5, True)
+    gpio.set_input(5, False)
+
+    assert changes == [("zone01", False), ("zone01", True), ("zone01", False)]
+    assert activations == []
+
+
+def test_active_after_debounce():
+    gpio, scheduler, engine, changes, activations = make_engine(FakeInput("zone01", 5, debounce=0.2))
+
+    gpio.set_input(5, True)
+    assert scheduler.timers[-1].seconds == 0.2
+
+    scheduler.fire()
+    assert activations == ["zone01"]
+    assert engine.active == {"zone01"}
+
+    gpio.set_input(5, False)
+    assert engine.active == set()
+
+
+def test_bounce_restarts_debounce():
+    gpio, scheduler, engine, changes, activations = make_engine(FakeInput("zone01", 5))
+
+    gpio.set_input(5, True)
+    gpio.set_input(5, False)
+    gpio.set_input(5, True)
+    scheduler.fire()
+
+    assert activations == ["zone01"]
+
+
+def test_input_active_at_start():
+    gpio = FakeGPIO()
+    gpio.levels[7] = 1
+    engine = InputEngine(gpio, schedule=Scheduler())
+    changes = []
+    engine.add(FakeInput("ext_tamper", 7))
+    engine.start(lambda i, value: changes.append(value), lambda i: None)
+
+    assert changes == [True]
+
+
+def test_reconcile_recovers_missed_edge():
+    gpio, scheduler, engine, changes, activations = make_engine(FakeInput("ext_tamper", 7))
+    levels = GpioLevels(gpio, [7], device="/nonexistent")
+
+    gpio.levels[7] = 1  # level changed without an edge callback
+
+    engine.reconcile(levels.read())
+    assert changes == [("ext_tamper", False)]  # may still be in flight, give it one more pass
+
+    engine.reconcile(levels.read())
+    assert changes == [("ext_tamper", False), ("ext_tamper", True)]
+    assert engine.resyncs == 1
+
+    scheduler.fire()
+    assert engine.active == {"ext_tamper"}
+
+
+def test_reconcile_ignores_settled_inputs():
+    gpio, scheduler, engine, changes, activations = make_engine(FakeInput("zone01", 5), FakeInput("zone02", 6))
+    levels = GpioLevels(gpio, [5, 6], device="/nonexistent")
+
+    gpio.set_input(6, True)
+    for _ in range(3):
+        engine.reconcile(levels.read())
+
+    assert engine.resyncs == 0
+
+
+def test_stop_cancels_debounce():
+    gpio, scheduler, engine, changes, activations = make_engine(FakeInput("zone01", 5))
+
+    gpio.set_input(5, True)
+    engine.stop()
+    scheduler.fire()
+
+    assert activations == []
+    assert gpio.callbacks == {}
+
+
+def test_levels_fallback_reads_each_pin():
+    gpio = FakeGPIO()
+    gpio.levels.update({2: 1, 3: 0, 17: 1})
+
+    assert GpioLevels(gpio, [2, 3, 17], device="/nonexistent").read() == (1 << 2) | (1 << 17)
+
+
+def test_levels_register_not_used_on_pi5(tmp_path):
+    compatible = tmp_path / "compatible"
+    compatible.write_bytes(b"raspberrypi,5-model-b\0brcm,bcm2712\0")
+    device = tmp_path / "gpiomem"
+    device.write_bytes(b"\xff" * 4096)  # would read as all pins high
+    gpio = FakeGPIO()
+    gpio.levels.update({2: 1, 3: 0})
+
+    assert GpioLevels(gpio, [2, 3], device=str(device), compatible=str(compatible)).read() == 1 << 2
+
+
+def test_levels_register_used_on_bcm2711(tmp_path):
+    compatible = tmp_path / "compatible"
+    compatible.write_bytes(b"raspberrypi,4-model-b\0brcm,bcm2711\0")
+    device = tmp_path / "gpiomem"
+    device.write_bytes(bytes(GpioLevels.GPLEV0) + (1 << 17).to_bytes(4, "little") + bytes(4096 - GpioLevels.GPLEV0 - 4))
+
+    assert GpioLevels(FakeGPIO(), [17], device=str(device), compatible=str(compatible)).read() == 1 << 17
@@ -0,0 +1,104 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from hass_discovery import Discovery
+
+
+class Broker:
+    """Fake paho client and broker keeping retained messages, replayed on subscribe."""
+    def __init__(self):
+        self.retained: dict[str, bytes] = {}
+        self.published: list[tuple[str, bytes, float]] = []
+        self.callback = None
+
+    def message_callback_add(self, topic: str, callback) -> None:
+        self.callback = callback
+
+    def message_callback_remove(self, topic: str) -> None:
+        self.callback = None
+
+    def subscribe(self, topic: str) -> None:
+        for retained_topic, payload in self.retained.items():
+            self.callback(self, None, SimpleNamespace(topic=retained_topic, payload=payload, retain=True))
+
+    def unsubscribe(self, topic: str) -> None:
+        pass
+
+    def publish(self, topic: str, payload: bytes, retain: bool = False) -> None:
+        self.published.append((topic, payload, time.monotonic()))
+
+        if not payload:
+            self.retained.pop(topic, None)
+        elif retain:
+            self.retained[topic] = payload
+
+    def topics(self) -> list[str]:
+        return [topic for topic, _, _ in self.published]
+
+
+def zones(count: int) -> dict[str, SimpleNamespace]:
+    return {f"zone{n:02}": SimpleNamespace(label=f"Zone {n}", dev_class=SimpleNamespace(value="door"))
+            for n in range(count)}
+
+
+def discovery(zone_list: dict, **kwargs) -> Discovery:
+    return Discovery(zone_list, {"hall": SimpleNamespace(label="Hall")}, rate=1000, settle=0.01, **kwargs)
+
+
+def test_only_changed_configs_republished():
+    broker, zone_list = Broker(), zones(10)
+    first = discovery(zone_list)
+
+    asyncio.run(first.publish(broker))
+    assert sorted(broker.topics()) == sorted(first.payloads)
+
+    # Restart with one zone renamed
+    broker.published.clear()
+    zone_list["zone03"].label = "Front door"
+    second = discovery(zone_list)
+    asyncio.run(second.publish(broker))
+
+    changed = [topic for topic in second.payloads if second.payloads[topic] != first.payloads[topic]]
+    assert len(changed) == 1
+    assert broker.topics() == changed
+
+
+def test_nothing_published_when_unchanged():
+    broker, zone_list = Broker(), zones(10)
+    asyncio.run(discovery(zone_list).publish(broker))
+
+    broker.published.clear()
+    asyncio.run(discovery(zone_list).publish(broker))
+
+    assert broker.published == []
+
+
+def test_removed_entities_cleared():
+    broker, zone_list = Broker(), zones(10)
+    first = discovery(zone_list)
+    asyncio.run(first.publish(broker))
+
+    broker.published.clear()
+    del zone_list["zone05"]
+    second = discovery(zone_list)
+    asyncio.run(second.publish(broker))
+
+    removed = set(first.payloads) - set(second.payloads)
+    assert len(removed) == 1
+    assert [(topic, payload) for topic, payload, _ in broker.published] == [(removed.pop(), b"")]
+    assert set(broker.retained) == set(second.payloads)
+
+
+@pytest.mark.parametrize("rate", [100, 400])
+def test_publishing_paced(rate):
+    broker = Broker()
+    paced = Discovery(zones(20), {}, rate=rate, settle=0.01)
+
+    asyncio.run(paced.publish(broker))
+
+    times = [t for _, _, t in broker.published]
+    assert len(times) == len(paced.payloads) > 20
+    assert min(b - a for a, b in zip(times, times[1:])) >= 0.9 / rate
@@ -0,0 +1,103 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from healthchecks import HealthChecks
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Healthchecks ping stub, answers with the statuses in server.script, then 200."""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_HEAD(self) -> None:
+        server = self.server
+        server.connections.add(self.client_address)
+        status = server.script.pop(0) if server.script else 200
+
+        if status == 200:
+            server.received.append(self.path)
+
+        self.send_response(status)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+
+        # Drop the connection without telling the client, like an idle timeout on the server
+        self.close_connection = server.drop_connections
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.script, server.received, server.connections = [], [], set()
+    server.drop_connections = False
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def client(server, **kwargs) -> HealthChecks:
+    return HealthChecks({"alarm": "uuid-alarm", "backup": "uuid-backup", "unused": ""},
+                        host="127.0.0.1", port=server.server_address[1], tls=False, **kwargs)
+
+
+def wait_for(condition, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_pings_sent_in_order(server):
+    healthchecks = client(server)
+
+    with healthchecks._condition:  # hold the worker until everything is queued
+        assert healthchecks.start("backup")
+        assert healthchecks.ping("alarm")
+        assert healthchecks.fail("alarm")
+        assert healthchecks.stop("backup")
+        assert not healthchecks.ping("unused")
+
+    assert wait_for(lambda: len(server.received) == 4)
+    assert server.received == ["/uuid-backup/start", "/uuid-alarm", "/uuid-alarm/fail", "/uuid-backup"]
+    assert len(server.connections) == 1
+    assert healthchecks.status["alarm"]["ok"] is True
+
+
+def test_stale_connection_retried_once(server):
+    server.drop_connections = True
+    results = []
+    healthchecks = client(server, on_result=lambda check, ok: results.append(ok))
+
+    healthchecks.ping("alarm")
+    assert wait_for(lambda: len(results) == 1)
+    healthchecks.ping("alarm")
+    assert wait_for(lambda: len(results) == 2)
+
+    assert results == [True, True]
+    assert len(server.connections) == 2
+    assert healthchecks.status["alarm"]["failures"] == 0
+
+
+def test_failure_does_not_block(server):
+    server.script[:] = [500, 500]
+    results = []
+    healthchecks = client(server, attempts=2, on_result=lambda check, ok: results.append((check, ok)))
+
+    start_time = time.monotonic()
+    healthchecks.fail("alarm")
+    healthchecks.ping("backup")
+    assert time.monotonic() - start_time < 0.1
+
+    assert wait_for(lambda: len(results) == 2)
+    assert results == [("alarm", False), ("backup", True)]
+    assert healthchecks.status["alarm"]["ok"] is False
+    assert healthchecks.status["alarm"]["failures"] == 1
+    assert server.received == ["/uuid-backup"]
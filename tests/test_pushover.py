@@ -0,0 +1,136 @@
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from pushover import Pushover
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Pushover API stub, answers with the statuses in server.script, then 200."""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        server = self.server
+        server.connections.add(self.client_address)
+        status = server.script.pop(0) if server.script else 200
+
+        if status == 200:
+            server.received.append(urllib.parse.parse_qs(body.decode())["title"][0])
+
+        payload = b'{"status":1}'
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("X-Limit-App-Remaining", "42")
+        self.send_header("X-Limit-App-Reset", str(int(time.time())))
+        self.end_headers()
+        self.wfile.write(payload)
+
+        # Drop the connection without telling the client, like an idle timeout on the server
+        self.close_connection = server.drop_connections
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.script, server.received, server.connections = [], [], set()
+    server.drop_connections = False
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def client(server, **kwargs) -> Pushover:
+    return Pushover("token", "user", host="127.0.0.1", port=server.server_address[1], tls=False, **kwargs)
+
+
+def wait_for(condition, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_keep_alive(server):
+    pushover = client(server)
+
+    for n in range(5):
+        pushover.push(f"message {n}", "text")
+
+    assert wait_for(lambda: pushover.stats["sent"] == 5)
+    assert server.received == [f"message {n}" for n in range(5)]
+    assert len(server.connections) == 1
+    assert pushover.limit_remaining == 42
+
+
+def test_emergency_jumps_queue(server):
+    pushover = client(server, max_queue=3)
+
+    with pushover._condition:  # hold the worker until everything is queued
+        for n in range(4):
+            pushover.push(f"low {n}", "text")
+        pushover.push("emergency", "text", 2)
+
+    assert wait_for(lambda: pushover.pending() == 0 and pushover.stats["sent"] == 3)
+    assert server.received[0] == "emergency"
+    assert pushover.stats["dropped"] == 2
+
+
+def test_retry_after_server_error(server):
+    server.script[:] = [500, 429]
+    pushover = client(server)
+
+    pushover.push("retried", "text")
+
+    assert wait_for(lambda: pushover.stats["sent"] == 1)
+    assert server.received == ["retried"]
+    assert pushover.stats["retries"] == 2
+
+
+def test_rejected_not_retried(server):
+    server.script[:] = [400]
+    pushover = client(server)
+
+    pushover.push("invalid", "text")
+    pushover.push("valid", "text")
+
+    assert wait_for(lambda: pushover.stats["sent"] == 1)
+    assert server.received == ["valid"]
+    assert pushover.stats["failed"] == 1
+    assert pushover.stats["retries"] == 0
+
+
+def test_reconnect_after_dropped_connection(server):
+    server.drop_connections = True
+    pushover = client(server)
+
+    pushover.push("first", "text")
+    assert wait_for(lambda: pushover.stats["sent"] == 1)
+
+    pushover.push("second", "text")
+    assert wait_for(lambda: pushover.stats["sent"] == 2)
+
+    assert server.received == ["first", "second"]
+    assert len(server.connections) == 2
+    assert pushover.stats["retries"] == 0  # the stale connection is replaced within the same attempt
+
+
+def test_duplicate_not_queued(server):
+    pushover = client(server)
+
+    with pushover._condition:
+        pushover.push("zone open", "Front door")
+        pushover.push("zone open", "Front door")
+
+    assert wait_for(lambda: pushover.stats["sent"] == 1)
+    time.sleep(0.1)
+    assert server.received == ["zone open"]
@@ -0,0 +1,62 @@
+import json
+import os
+
+import atomic
+from settings import Settings
+
+
+def test_write_and_read_back(tmp_path):
+    path = tmp_path / "settings.json"
+    settings = Settings(str(path), min_interval=60)
+
+    settings.set("alarm", "siren_volume", 3)
+    settings.set("zones", "door1_bypass", True)
+    settings.set("alarm", "siren_volume", 3)  # unchanged, no extra write
+    settings.flush()
+    settings.flush()
+
+    assert settings.writes == 1
+    assert Settings(str(path)).get("zones", "door1_bypass") is True
+    assert json.loads(path.read_text()) == {"alarm": {"siren_volume": 3}, "zones": {"door1_bypass": True}}
+
+
+def test_missing_file(tmp_path):
+    settings = Settings(str(tmp_path / "settings.json"))
+
+    assert settings.data == {}
+    assert settings.get("alarm", "siren_volume", 2) == 2
+
+
+def test_corrupt_file(tmp_path):
+    path = tmp_path / "settings.json"
+    path.write_text('{"alarm": {"siren_volume": 3')
+
+    settings = Settings(str(path), min_interval=60)
+    assert settings.get("alarm", "siren_volume", 2) == 2
+
+    settings.set("alarm", "siren_volume", 4)
+    settings.flush()
+    assert Settings(str(path)).get("alarm", "siren_volume") == 4
+
+
+def test_atomic_replace(tmp_path, monkeypatch):
+    path = tmp_path / "settings.json"
+    settings = Settings(str(path), min_interval=60)
+    settings.set("alarm", "siren_volume", 3)
+    settings.flush()
+
+    def full_disk(fd):
+        raise OSError(28, "No space left on device")
+
+    settings.set("alarm", "siren_volume", 4)
+    monkeypatch.setattr(atomic.os, "fsync", full_disk)
+    settings.flush()
+    monkeypatch.undo()
+
+    # The old file is left whole, the change is written on the next round
+    assert Settings(str(path)).get("alarm", "siren_volume") == 3
+    assert not os.path.exists(f"{path}.tmp")
+    assert settings._dirty.is_set()
+
+    settings.flush()
+    assert Settings(str(path)).get("alarm", "siren_volume") == 4
@@ -0,0 +1,73 @@
+import os
+import threading
+import time
+
+import spool as spool_module
+from spool import Spool
+
+
+def wait_for(condition, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_replay_after_restart(tmp_path):
+    path = str(tmp_path / "notifications.spool")
+    spool = Spool(path)
+    first = spool.add({"title": "first"})
+    second = spool.add({"title": "second"})
+    spool.done(first)
+
+    restarted = Spool(path)
+
+    assert restarted.pending() == [(second, {"title": "second"})]
+    assert restarted.add({"title": "third"}) > second  # ids are not reused
+
+
+def test_delivered_dropped(tmp_path):
+    path = str(tmp_path / "notifications.spool")
+    spool = Spool(path)
+    entry_id = spool.add({"title": "delivered"})
+    spool.done(entry_id)
+    spool.done(entry_id)  # a second done is ignored
+
+    assert spool.pending() == []
+    assert Spool(path).pending() == []
+
+
+def test_compaction(tmp_path):
+    path = str(tmp_path / "notifications.spool")
+    spool = Spool(path, max_bytes=1024)
+
+    for n in range(100):
+        spool.done(spool.add({"title": f"message {n}"}))
+    kept = spool.add({"title": "kept"})
+
+    assert os.path.getsize(path) < 2048
+    assert not os.path.exists(f"{path}.tmp")
+    assert Spool(path).pending() == [(kept, {"title": "kept"})]
+
+
+def test_damaged_record_skipped(tmp_path):
+    path = tmp_path / "notifications.spool"
+    path.write_bytes(b'{"add":1,"entry":{"title":"kept"}}\n{"add":2,"ent')
+
+    assert Spool(str(path)).pending() == [(1, {"title": "kept"})]
+
+
+def test_urgent_synced_off_the_caller(tmp_path, monkeypatch):
+    synced = []
+    fsync = os.fsync
+    monkeypatch.setattr(spool_module.os, "fsync",
+                        lambda fd: (synced.append((fd, threading.current_thread())), fsync(fd)))
+    spool = Spool(str(tmp_path / "notifications.spool"), sync_interval=10)
+    synced.clear()  # the initial compaction
+
+    spool.add({"title": "emergency"}, sync=True)
+
+    assert wait_for(lambda: any(fd == spool._fd for fd, _ in synced))  # not held back by sync_interval
+    assert threading.current_thread() not in [thread for _, thread in synced]
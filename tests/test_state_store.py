@@ -0,0 +1,56 @@
+import json
+
+import atomic
+from state_store import StateLog
+
+
+def test_append_and_load(tmp_path):
+    path = tmp_path / "state.log"
+    log = StateLog(str(path))
+    log.load()
+
+    log.append({"state": "armed_away"})
+    log.append({"zones": {"door1": True}}, sync=True)
+    log.append({"zones": {"door2": False}})
+    log.flush()
+
+    assert StateLog(str(path)).load() == {"state": "armed_away", "zones": {"door1": True, "door2": False}}
+
+
+def test_damaged_records_skipped(tmp_path):
+    path = tmp_path / "state.log"
+    path.write_bytes(b'{"state":"armed_home"}\n12\n"text"\n[1,2]\n{"zones":{"door1":tr')
+
+    assert StateLog(str(path)).load() == {"state": "armed_home"}
+
+
+def test_compacted_past_max_bytes(tmp_path):
+    path = tmp_path / "state.log"
+    log = StateLog(str(path), max_bytes=200)
+    log.load()
+
+    for n in range(50):
+        log.append({"code_attempts": n})
+    log.flush()
+
+    assert len(path.read_bytes()) <= 200
+    assert json.loads(path.read_bytes().splitlines()[-1]) == {"code_attempts": 49}
+    assert StateLog(str(path)).load() == {"code_attempts": 49}
+
+
+def test_failed_compaction_keeps_log(tmp_path, monkeypatch):
+    path = tmp_path / "state.log"
+    log = StateLog(str(path))
+    log.load()
+    log.append({"state": "armed_away"})
+    log.flush()
+
+    def full_disk(fd):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(atomic.os, "fsync", full_disk)
+    log.compact()
+    monkeypatch.undo()
+
+    assert not (tmp_path / "state.log.tmp").exists()
+    assert StateLog(str(path)).load() == {"state": "armed_away"}
@@ -0,0 +1,65 @@
+import time
+from array import array
+from typing import Optional
+
+
+class ZoneRegistry:
+    """
+    Column store for zone state.
+
+    Every zone gets a stable index and a bit (1 << index). Values and last change timestamps
+    live in arrays, group membership and the currently active zones are bit masks, so an
+    "any zone active in group" check is a single AND.
+    """
+    def __init__(self, zones: dict):
+        self.zones: list = list(zones.values())
+        self.values: array = array('b', [-1] * len(self.zones))  # -1 unknown, 0 false, 1 true
+        self.timestamps: array = array('d', [0.0] * len(self.zones))
+        self.masks: dict[str, int] = {}
+        self.active: int = 0
+
+        for index, zone in enumerate(self.zones):
+            zone.index = index
+            zone.mask = 1 << index
+
+    def add_group(self, name: str, members: list) -> int:
+        mask = 0
+        for zone in members:
+            mask |= zone.mask
+
+        self.masks[name] = mask
+        return mask
+
+    def get(self, zone) -> Optional[bool]:
+        value = self.values[zone.index]
+        return None if value < 0 else bool(value)
+
+    def set(self, zone, value: Optional[bool]) -> bool:
+        packed = -1 if value is None else int(value)
+
+        if self.values[zone.index] == packed:
+            return False
+
+        self.values[zone.index] = packed
+        self.timestamps[zone.index] = time.time()
+
+        if value:
+            self.active |= zone.mask
+        else:
+            self.active &= ~zone.mask
+
+        return True
+
+    def any_active(self, group: str) -> bool:
+        return bool(self.active & self.masks[group])
+
+    def active_zones(self, group: str) -> list:
+        mask = self.active & self.masks[group]
+        zones = []
+
+        while mask:
+            bit = mask & -mask
+            zones.append(self.zones[bit.bit_length() - 1])
+            mask ^= bit
+
+        return zones